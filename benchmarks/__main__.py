@@ -0,0 +1,108 @@
+import argparse
+import json
+import multiprocessing
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from path_tmpl_worker.db import Base
+
+from benchmarks import __doc__ as usage
+from benchmarks import database_url
+from benchmarks.dataset import TEMPLATES, DatasetSpec, generate
+from benchmarks.scenarios import SCENARIOS, run
+
+
+def run_isolated(scenario: str, url: str, spec: DatasetSpec, samples: int) -> dict:
+    """Generates dataset, runs scenario in a spawned process, drops dataset"""
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    try:
+        with sessionmaker(engine, expire_on_commit=False)() as session:
+            dataset = generate(session, spec)
+            document_ids = dataset.sample_document_ids(session, samples)
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            future = executor.submit(
+                run,
+                scenario,
+                url,
+                asdict(spec),
+                document_ids,
+                dataset.document_type_ids,
+            )
+            return future.result()
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=usage, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--database",
+        action="append",
+        help='"sqlite" (temporary file) or database URL; may be repeated',
+    )
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS), default=None
+    )
+    parser.add_argument(
+        "--template", action="append", choices=sorted(TEMPLATES), default=None
+    )
+    parser.add_argument("--documents", type=int, default=10_000)
+    parser.add_argument("--fields", type=int, default=4)
+    parser.add_argument("--owners", type=int, default=1)
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=200,
+        help="documents moved/updated one by one in single document scenarios",
+    )
+    parser.add_argument("--output", type=Path, help="JSON file; default: stdout")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for database in args.database or ["sqlite"]:
+            url = database_url(database, tmp_dir)
+            for template in args.template or sorted(TEMPLATES):
+                spec = DatasetSpec(
+                    documents=args.documents,
+                    fields=args.fields,
+                    owners=args.owners,
+                    template=template,
+                )
+                for scenario in args.scenario or sorted(SCENARIOS):
+                    result = run_isolated(scenario, url, spec, args.samples)
+                    print(
+                        f"{result['database']:>10} {template:>6} {scenario:>15}: "
+                        f"{result['throughput']:10.1f} docs/s, "
+                        f"p50 {result['p50_ms']:8.2f} ms, "
+                        f"p95 {result['p95_ms']:8.2f} ms",
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
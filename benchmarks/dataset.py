@@ -0,0 +1,186 @@
+"""Synthetic dataset generator
+
+Creates `owners` users (each with home and inbox folder), one document
+type per owner with `fields` custom fields of mixed types, and `documents`
+documents spread evenly among owners. All documents are in their owner's
+home folder and have values for all custom fields.
+
+First two custom fields are always "Shop" (text) and "EffectiveDate"
+(date), as they are used by path templates (see `TEMPLATES`).
+"""
+
+import random
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from itertools import batched
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from path_tmpl_worker import constants
+from path_tmpl_worker.db import orm
+from path_tmpl_worker.models import CustomFieldType
+
+# rows per INSERT statement
+INSERT_BATCH_SIZE = 5000
+
+TEMPLATES = {
+    # all documents in the same folder
+    "flat": "/home/Receipts/",
+    # few hundred folders, three levels deep
+    "deep": """
+        {% set day = document.cf['EffectiveDate'] | string %}
+        /home/Archive/{{ document.cf['Shop'] }}/{{ day[:4] }}/{{ day[5:7] }}/
+    """,
+    # one folder per document
+    "unique": "/home/Documents/{{ document.id }}/{{ document.title }}",
+}
+
+SHOPS = [f"shop-{i:02}" for i in range(20)]
+START_DATE = date(2023, 1, 1)
+# cycle of types of custom fields after "Shop" and "EffectiveDate"
+EXTRA_CF_TYPES = [
+    CustomFieldType.monetary,
+    CustomFieldType.int,
+    CustomFieldType.boolean,
+    CustomFieldType.text,
+    CustomFieldType.float,
+    CustomFieldType.date,
+]
+
+
+@dataclass
+class DatasetSpec:
+    documents: int
+    fields: int = 2
+    owners: int = 1
+    template: str = "flat"
+
+
+@dataclass
+class Dataset:
+    spec: DatasetSpec
+    user_ids: list[uuid.UUID] = field(default_factory=list)
+    document_type_ids: list[uuid.UUID] = field(default_factory=list)
+    # name -> type of custom fields
+    custom_fields: dict[str, CustomFieldType] = field(default_factory=dict)
+
+    def sample_document_ids(self, session: Session, count: int) -> list[uuid.UUID]:
+        stmt = select(orm.Document.id).order_by(func.random()).limit(count)
+        return list(session.scalars(stmt))
+
+
+def cf_types(fields: int) -> dict[str, CustomFieldType]:
+    if fields < 2:
+        raise ValueError("At least two custom fields are needed")
+
+    result = {"Shop": CustomFieldType.text, "EffectiveDate": CustomFieldType.date}
+    for i in range(fields - 2):
+        result[f"field_{i:02}"] = EXTRA_CF_TYPES[i % len(EXTRA_CF_TYPES)]
+
+    return result
+
+
+def random_value(rnd: random.Random, name: str, cf_type: CustomFieldType):
+    """Returns value of the custom field as stored in `custom_field_values`"""
+    if name == "Shop":
+        return rnd.choice(SHOPS)
+
+    match cf_type:
+        case CustomFieldType.date:
+            return START_DATE + timedelta(days=rnd.randrange(730))
+        case CustomFieldType.monetary | CustomFieldType.float:
+            return round(rnd.uniform(1, 500), 2)
+        case CustomFieldType.int:
+            return rnd.randrange(1000)
+        case CustomFieldType.boolean:
+            return rnd.random() < 0.5
+        case _:
+            return f"text-{rnd.randrange(1000)}"
+
+
+def generate(session: Session, spec: DatasetSpec, seed: int = 0) -> Dataset:
+    rnd = random.Random(seed)
+    dataset = Dataset(spec=spec, custom_fields=cf_types(spec.fields))
+    path_template = TEMPLATES[spec.template]
+
+    custom_fields = [
+        orm.CustomField(id=uuid.uuid4(), name=name, type=cf_type)
+        for name, cf_type in dataset.custom_fields.items()
+    ]
+    session.add_all(custom_fields)
+
+    homes = []
+    for i in range(spec.owners):
+        user_id = uuid.uuid4()
+        home = orm.Folder(
+            id=uuid.uuid4(),
+            title=constants.HOME_TITLE,
+            ctype=constants.CTYPE_FOLDER,
+            lang="en",
+            user_id=user_id,
+        )
+        inbox = orm.Folder(
+            id=uuid.uuid4(),
+            title=constants.INBOX_TITLE,
+            ctype=constants.CTYPE_FOLDER,
+            lang="en",
+            user_id=user_id,
+        )
+        user = orm.User(
+            id=user_id,
+            username=f"owner-{i}",
+            email=f"owner-{i}@mail.com",
+            password="pwd",
+            is_active=True,
+        )
+        dtype = orm.DocumentType(
+            id=uuid.uuid4(),
+            name="Receipts",
+            path_template=path_template,
+            custom_fields=custom_fields,
+            user_id=user_id,
+        )
+        session.add_all([home, inbox, user])
+        session.flush()
+        user.home_folder_id = home.id
+        user.inbox_folder_id = inbox.id
+        session.add(dtype)
+        homes.append(home.id)
+        dataset.user_ids.append(user_id)
+        dataset.document_type_ids.append(dtype.id)
+    session.commit()
+
+    for batch in batched(range(spec.documents), INSERT_BATCH_SIZE):
+        documents = []
+        values = []
+        for i in batch:
+            owner = i % spec.owners
+            document_id = uuid.uuid4()
+            documents.append(
+                dict(
+                    id=document_id,
+                    ctype="document",
+                    title=f"document-{i}.pdf",
+                    document_type_id=dataset.document_type_ids[owner],
+                    user_id=dataset.user_ids[owner],
+                    lang="en",
+                    parent_id=homes[owner],
+                )
+            )
+            for cf in custom_fields:
+                values.append(
+                    {
+                        "id": uuid.uuid4(),
+                        "document_id": document_id,
+                        "field_id": cf.id,
+                        f"value_{cf.type.value}": random_value(rnd, cf.name, cf.type),
+                    }
+                )
+        session.execute(insert(orm.Document), documents)
+        for values_batch in batched(values, INSERT_BATCH_SIZE):
+            session.execute(insert(orm.CustomFieldValue), list(values_batch))
+        session.commit()
+
+    return dataset
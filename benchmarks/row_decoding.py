@@ -0,0 +1,126 @@
+"""Throughput of bulk move row decoding: pydantic models vs slotted records
+
+Usage:
+
+    poetry run python benchmarks/row_decoding.py --documents 100000 --fields 10
+
+No database is involved: rows are synthetic, shaped as they come from the
+row-per-custom-field query (before) and from the pivoted query (after).
+"""
+
+import argparse
+import os
+import time
+import uuid
+from datetime import date, timedelta
+
+os.environ.setdefault("PAPERMERGE__DATABASE__URL", "sqlite://")
+
+from pathtmpl import CField, DocumentContext  # noqa: E402
+
+from path_tmpl_worker import models  # noqa: E402
+from path_tmpl_worker.ordered_document_cfv import (  # noqa: E402
+    OrderedDocumentCFV,
+    convert_cf_value,
+)
+from path_tmpl_worker.records import DocumentRecord, TemplateContext  # noqa: E402
+
+CF_TYPES = ["text", "monetary", "date", "boolean"]
+
+
+def make_rows(documents: int, fields: int):
+    type_id = uuid.uuid4()
+    parent_id = uuid.uuid4()
+    cf_types = {f"field_{i:02}": CF_TYPES[i % len(CF_TYPES)] for i in range(fields)}
+    values = {
+        "text": "rewe",
+        "monetary": "10.99",
+        "date": str(date(2024, 1, 1) + timedelta(days=fields)),
+        "boolean": "true",
+    }
+    docs = []
+    for i in range(documents):
+        docs.append(
+            (
+                f"doc-{i}.pdf",
+                uuid.uuid4(),
+                type_id,
+                parent_id,
+                {name: values[cf_type] for name, cf_type in cf_types.items()},
+            )
+        )
+
+    return cf_types, docs
+
+
+def decode_before(cf_types, docs) -> int:
+    ordered = OrderedDocumentCFV()
+    for title, doc_id, type_id, parent_id, cf_values in docs:
+        for name, value in cf_values.items():
+            ordered.add(
+                models.DocumentCFVRow(
+                    title=title,
+                    doc_id=doc_id,
+                    document_type_id=type_id,
+                    parent_id=parent_id,
+                    cf_name=name,
+                    cf_type=cf_types[name],
+                    cf_value=value,
+                )
+            )
+
+    count = 0
+    for doc_cfv in ordered:
+        DocumentContext(
+            id=doc_cfv.id,
+            title=doc_cfv.title,
+            custom_fields=[
+                CField(name=cf[0], value=cf[1]) for cf in doc_cfv.custom_fields
+            ],
+        )
+        count += 1
+
+    return count
+
+
+def decode_after(cf_types, docs) -> int:
+    count = 0
+    for title, doc_id, type_id, parent_id, cf_values in docs:
+        custom_fields = []
+        for name in sorted(cf_values):
+            cf_type = cf_types[name]
+            custom_fields.append(
+                (name, convert_cf_value(cf_type, cf_values[name]), cf_type)
+            )
+        record = DocumentRecord(doc_id, title, parent_id, type_id, custom_fields)
+        TemplateContext.from_record(record)
+        count += 1
+
+    return count
+
+
+def measure(func, cf_types, docs) -> float:
+    started = time.perf_counter()
+    count = func(cf_types, docs)
+    elapsed = time.perf_counter() - started
+
+    return count * len(cf_types) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=20_000)
+    parser.add_argument("--fields", type=int, default=10)
+    args = parser.parse_args()
+
+    cf_types, docs = make_rows(args.documents, args.fields)
+    before = measure(decode_before, cf_types, docs)
+    after = measure(decode_after, cf_types, docs)
+
+    print(f"documents: {args.documents}, custom fields: {args.fields}")
+    print(f"pydantic models: {before:12,.0f} rows/s")
+    print(f"slotted records: {after:12,.0f} rows/s ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark scenarios
+
+Each scenario runs in a fresh (spawned) process against an already
+generated dataset, so that peak RSS is the one of the scenario alone and
+caches (e.g. compiled templates) start cold.
+"""
+
+import resource
+import statistics
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from path_tmpl_worker import api, config
+from path_tmpl_worker.db import update_doc_cfv
+from path_tmpl_worker.db.engine import pool_options
+
+from benchmarks.dataset import SHOPS, START_DATE
+
+
+@dataclass
+class Result:
+    scenario: str
+    database: str
+    documents: int
+    fields: int
+    owners: int
+    template: str
+    # number of documents processed
+    operations: int
+    seconds: float
+    # documents per second
+    throughput: float
+    # latency of one operation (one document, or one document type for
+    # `move_documents`)
+    p50_ms: float
+    p95_ms: float
+    peak_rss_kb: int
+    queries: int
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def percentile(latencies: list[float], pct: int) -> float:
+    if len(latencies) == 1:
+        return latencies[0]
+
+    return statistics.quantiles(latencies, n=100, method="inclusive")[pct - 1]
+
+
+def move_document(Session, document_ids, document_type_ids):
+    latencies = []
+    for document_id in document_ids:
+        started = time.perf_counter()
+        with Session() as session:
+            api.move_document(session, document_id)
+        latencies.append(time.perf_counter() - started)
+
+    return len(document_ids), latencies
+
+
+def move_documents(Session, document_ids, document_type_ids):
+    latencies = []
+    operations = 0
+    for document_type_id in document_type_ids:
+        started = time.perf_counter()
+        with Session() as session:
+            result = api.move_documents(session, document_type_id)
+        latencies.append(time.perf_counter() - started)
+        operations += result.count + result.unchanged_count
+
+    return operations, latencies
+
+
+def update_cfv(Session, document_ids, document_type_ids):
+    latencies = []
+    for i, document_id in enumerate(document_ids):
+        custom_fields = {
+            "Shop": SHOPS[i % len(SHOPS)],
+            "EffectiveDate": str(START_DATE + timedelta(days=i % 730)),
+        }
+        started = time.perf_counter()
+        with Session() as session:
+            update_doc_cfv(session, document_id, custom_fields=custom_fields)
+        latencies.append(time.perf_counter() - started)
+
+    return len(document_ids), latencies
+
+
+SCENARIOS = {
+    "move_document": move_document,
+    "move_documents": move_documents,
+    "update_doc_cfv": update_cfv,
+}
+
+
+def run(
+    scenario: str,
+    url: str,
+    spec: dict,
+    document_ids: list[uuid.UUID],
+    document_type_ids: list[uuid.UUID],
+) -> dict:
+    """Runs the scenario; returns `Result` as dict"""
+    engine = create_engine(url, **pool_options(url, config.get_settings()))
+    Session = sessionmaker(engine, expire_on_commit=False)
+    queries = 0
+
+    def count_query(*args, **kwargs):
+        nonlocal queries
+        queries += 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+    started = time.perf_counter()
+    operations, latencies = SCENARIOS[scenario](
+        Session, document_ids, document_type_ids
+    )
+    seconds = time.perf_counter() - started
+    engine.dispose()
+
+    return Result(
+        scenario=scenario,
+        database=engine.dialect.name,
+        documents=spec["documents"],
+        fields=spec["fields"],
+        owners=spec["owners"],
+        template=spec["template"],
+        operations=operations,
+        seconds=round(seconds, 4),
+        throughput=round(operations / seconds, 2) if seconds > 0 else 0,
+        p50_ms=round(percentile(latencies, 50) * 1000, 3),
+        p95_ms=round(percentile(latencies, 95) * 1000, 3),
+        # kilobytes on Linux
+        peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        queries=queries,
+    ).as_dict()
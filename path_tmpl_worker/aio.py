@@ -0,0 +1,121 @@
+"""Asyncio variant of `path_tmpl_worker.api`
+
+Functions run the synchronous API inside `AsyncSession.run_sync`: SQL is
+executed by the asyncio driver (psycopg async), thus each DB round trip
+yields to the event loop and many moves progress concurrently in one
+thread. Path template evaluation and the rest of the CPU work still runs
+in the event loop thread.
+
+    runner = AsyncRunner(concurrency=20)
+    asyncio.run(runner.run(document_ids))
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Callable, Collection, Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from path_tmpl_worker import api, config
+from path_tmpl_worker.db.engine import get_async_sessionmaker
+from path_tmpl_worker.models import (
+    DocumentMovedNotification,
+    DocumentsMovedNotification,
+    MovePlan,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def move_document(
+    db_session: AsyncSession,
+    document_id: uuid.UUID,
+    superseded: Callable[[uuid.UUID, uuid.UUID], bool] | None = None,
+    changed_fields: Collection[str] | None = None,
+    title_changed: bool = False,
+) -> DocumentMovedNotification | None:
+    """Same as `api.move_document`"""
+    return await db_session.run_sync(
+        api.move_document,
+        document_id,
+        superseded=superseded,
+        changed_fields=changed_fields,
+        title_changed=title_changed,
+    )
+
+
+async def move_documents(
+    db_session: AsyncSession, document_type_id: uuid.UUID, **kwargs
+) -> DocumentsMovedNotification:
+    """Same as `api.move_documents` (takes the same keyword arguments)"""
+    return await db_session.run_sync(api.move_documents, document_type_id, **kwargs)
+
+
+async def plan_move_documents(
+    db_session: AsyncSession, document_type_id: uuid.UUID, **kwargs
+) -> MovePlan:
+    """Same as `api.plan_move_documents`"""
+    return await db_session.run_sync(
+        api.plan_move_documents, document_type_id, **kwargs
+    )
+
+
+class AsyncRunner:
+    """Moves many documents concurrently on one event loop
+
+    At most `concurrency` documents are moved at the same time, each in
+    its own session. Failed moves are logged and counted, they do not
+    stop the run. `on_moved` is called with notification of each moved
+    document.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker | None = None,
+        concurrency: int | None = None,
+        on_moved: Callable[[DocumentMovedNotification], None] | None = None,
+    ):
+        if concurrency is None:
+            concurrency = config.get_settings().papermerge__path_tmpl__async_concurrency
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+
+        self.sessionmaker = sessionmaker or get_async_sessionmaker()
+        self.concurrency = concurrency
+        self.on_moved = on_moved
+        self.moved = 0
+        self.skipped = 0
+        self.failed = 0
+
+    async def move_document(
+        self, document_id: uuid.UUID
+    ) -> DocumentMovedNotification | None:
+        try:
+            async with self.sessionmaker() as db_session:
+                message = await move_document(db_session, document_id)
+        except Exception:
+            logger.exception(f"Failed to move document {document_id}")
+            self.failed += 1
+            return None
+
+        if message is None:
+            self.skipped += 1
+            return None
+
+        self.moved += 1
+        if self.on_moved:
+            self.on_moved(message)
+
+        return message
+
+    async def run(self, document_ids: Iterable[uuid.UUID]):
+        """Moves all documents; IDs are consumed lazily"""
+        pending = iter(document_ids)
+
+        async def work():
+            # iterator is shared by all workers; safe as `next` never awaits
+            for document_id in pending:
+                await self.move_document(document_id)
+
+        await asyncio.gather(*(work() for _ in range(self.concurrency)))
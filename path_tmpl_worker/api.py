@@ -1,32 +1,80 @@
+import logging
+import time
+from contextlib import contextmanager
+from functools import partial
 from pathlib import PurePath
+from typing import Callable, Collection, Iterable, Iterator, TypeAlias
 import uuid
 
 from sqlalchemy import update
 from sqlalchemy.orm import Session
-from path_tmpl_worker import db
-from pathtmpl import DocumentContext, CField, get_evaluated_path
+from path_tmpl_worker import constants, db, metrics, template_cache
+from path_tmpl_worker.checkpoint import CheckpointStore
 
-from path_tmpl_worker.db.orm import Document
+from path_tmpl_worker.db.orm import Document, DocumentType
+from path_tmpl_worker.parallel import ParallelEvaluator, can_start_pool
+from path_tmpl_worker.records import (
+    DocumentRecord,
+    DocumentUpdate,
+    PlannedMove,
+    TemplateContext,
+)
 from path_tmpl_worker.models import (
-    DocumentCFV,
     BulkUpdate,
     DocumentsMovedNotification,
     DocumentMovedNotification,
+    MoveCheckpoint,
+    MovePlan,
 )
 
+logger = logging.getLogger(__name__)
+
+# (source folder id, target folder id) of a moved document
+Move: TypeAlias = tuple[uuid.UUID | None, uuid.UUID]
+
+# number of documents per batch of bulk updates; each batch is committed
 PAGE_SIZE = 1000
+# number of documents per batch sent to template evaluation process pool
+EVAL_BATCH_SIZE = 250
+
+# yields each document together with its evaluated path
+Evaluate: TypeAlias = Callable[
+    [Iterable[DocumentRecord]], Iterator[tuple[DocumentRecord, str]]
+]
 
 
 def move_document(
-    db_session: Session, document_id: uuid.UUID
-) -> DocumentMovedNotification:
+    db_session: Session,
+    document_id: uuid.UUID,
+    superseded: Callable[[uuid.UUID, uuid.UUID], bool] | None = None,
+    changed_fields: Collection[str] | None = None,
+    title_changed: bool = False,
+) -> DocumentMovedNotification | None:
     """Move document
 
     Evaluate new document path (based on path template of the associated
     document type) and (maybe) move document to the new location.
     Document may eventually get new title.
+
+    `superseded` is called with document type ID and document ID; if it
+    returns True (e.g. pending bulk move will take care of the document),
+    document is not moved and None is returned.
+
+    `changed_fields` are names of custom fields changed since the document
+    was last moved (`title_changed` tells whether title changed); if the
+    path template uses none of them, None is returned right away (see
+    `affected_by`). None means that anything may have changed.
     """
-    document = db.get_document(db_session, document_id)
+    if changed_fields is not None and not affected_by(
+        db_session, document_id, changed_fields, title_changed=title_changed
+    ):
+        return None
+
+    with metrics.stage("fetch_document"):
+        document = db.get_document(db_session, document_id)
+    if superseded and superseded(document.document_type_id, document_id):
+        return None
+
     source_folder_id = document.parent_id
     old_document_title = document.title
     ev_path, target_parent = db.mkdir_target(db_session, document_id)
@@ -41,7 +89,8 @@ def move_document(
 
     document.parent_id = target_parent.id
 
-    db_session.commit()
+    with metrics.stage("commit"):
+        db_session.commit()
     return DocumentMovedNotification(
         document_id=document_id,
         old_document_title=old_document_title,
@@ -51,8 +100,43 @@ def move_document(
     )
 
 
+def affected_by(
+    db_session: Session,
+    document_id: uuid.UUID,
+    changed_fields: Collection[str],
+    title_changed: bool = False,
+) -> bool:
+    """Returns True if the changes may change evaluated path of the document
+
+    Decided on the custom fields and title referenced by the path template
+    (see `template_deps`); only the path template is read from DB. Templates
+    which cannot be analyzed are always affected.
+    """
+    path_template = db.get_path_template(db_session, document_id)
+    if path_template is None:
+        # let `move_document` report it
+        return True
+
+    deps = template_cache.get_compiled_template(path_template).deps
+    if deps.cf_names is None:
+        return True
+    if title_changed and deps.title:
+        return True
+
+    return not deps.cf_names.isdisjoint(changed_fields)
+
+
 def move_documents(
-    db_session: Session, document_type_id: uuid.UUID
+    db_session: Session,
+    document_type_id: uuid.UUID,
+    eval_workers: int = 0,
+    eval_batch_size: int = EVAL_BATCH_SIZE,
+    checkpoints: CheckpointStore | None = None,
+    run_id: str | None = None,
+    resume: bool = True,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    on_page: Callable[[uuid.UUID | None], None] | None = None,
 ) -> DocumentsMovedNotification:
     """Move documents in bulk
 
@@ -61,87 +145,383 @@ def move_documents(
         template of the associated document type)
     And then apply bulk update of the new docs.parent_id and docs.title
     (both paren_id and title may change depending on the evaluated path)
+
+    Documents are streamed from DB and updates are applied in batches of
+    `PAGE_SIZE` documents, so memory usage does not grow with number of
+    documents. Documents which already are at their evaluated path are
+    not updated; they are reported in `unchanged_count` of the notification.
+
+    Each batch is committed separately. With `checkpoints` store, progress
+    is saved after each commit, together with `run_id` (e.g. Celery task ID).
+    If `resume` is true, run with the same `run_id` (e.g. redelivered task)
+    resumes after the last committed document of the interrupted run, unless
+    the path template changed meanwhile. Checkpoints of other runs are
+    ignored. Folder IDs in the notification of a resumed run cover only the
+    resumed part.
+
+    `after_id` and `until_id` restrict the run to one chunk of documents
+    (see `db.get_chunk_bounds`); checkpoints are meant for whole runs only.
+
+    `on_page` is called before each page is read, with ID of the last
+    document of the page (None for the last page).
+
+    With `eval_workers` > 0 path template is evaluated in a process pool
+    of that many workers (see `parallel.ParallelEvaluator`), in batches of
+    `eval_batch_size` documents.
     """
     dtype = db.get_document_type(db_session, document_type_id)
-    total_count = db.get_docs_count_by_type(db_session, document_type_id)
-    # May happen that `total_count == 0`
-    page_size = min(PAGE_SIZE, total_count) or PAGE_SIZE
-    # to avoid `page_size` == 0 we do: page_size = min(...) or PAGE_SIZE
-    number_of_pages = int(total_count / page_size) + 1
+    with evaluator(dtype.path_template, eval_workers, eval_batch_size) as evaluate:
+        return _move_documents(
+            db_session,
+            dtype,
+            evaluate,
+            checkpoints=checkpoints,
+            run_id=run_id,
+            resume=resume,
+            after_id=after_id,
+            until_id=until_id,
+            on_page=on_page,
+        )
+
+
+def plan_move_documents(
+    db_session: Session,
+    document_type_id: uuid.UUID,
+    on_move: Callable[[PlannedMove], None] | None = None,
+    eval_workers: int = 0,
+    eval_batch_size: int = EVAL_BATCH_SIZE,
+) -> MovePlan:
+    """Same as `move_documents`, but only reports what would be done
+
+    Nothing is written to DB. Documents are streamed and evaluated the
+    same way as in `move_documents`; `on_move` is called with the planned
+    move of each document (including the ones which would not move).
+    """
+    dtype = db.get_document_type(db_session, document_type_id)
+    with evaluator(dtype.path_template, eval_workers, eval_batch_size) as evaluate:
+        return _plan_move_documents(db_session, dtype, evaluate, on_move)
+
+
+@contextmanager
+def evaluator(
+    path_template: str, eval_workers: int = 0, eval_batch_size: int = EVAL_BATCH_SIZE
+) -> Iterator[Evaluate]:
+    """Yields `Evaluate` function of the path template
+
+    With `eval_workers` > 0 evaluation runs in a process pool, unless
+    current process cannot start one; then it falls back to serial evaluation.
+    """
+    if eval_workers > 0 and not can_start_pool():
+        logger.warning(
+            "Process pool cannot be started from daemonic process (e.g."
+            " Celery prefork pool); path templates are evaluated serially"
+        )
+        eval_workers = 0
+
+    if eval_workers > 0:
+        with ParallelEvaluator(
+            path_template, workers=eval_workers, batch_size=eval_batch_size
+        ) as parallel:
+            yield parallel.evaluate
+        return
+
+    compiled = template_cache.get_compiled_template(path_template)
+    yield partial(evaluate_documents, compiled=compiled)
+
+
+def _move_documents(
+    db_session: Session,
+    dtype: DocumentType,
+    evaluate: Evaluate,
+    checkpoints: CheckpointStore | None = None,
+    run_id: str | None = None,
+    resume: bool = True,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    on_page: Callable[[uuid.UUID | None], None] | None = None,
+) -> DocumentsMovedNotification:
+    resolver = db.FolderResolver()
+    fingerprint = template_cache.fingerprint(dtype.path_template)
+    # fetch only custom fields referenced by the template
+    deps = template_cache.get_compiled_template(dtype.path_template).deps
     total_moved = 0
+    total_unchanged = 0
     source_folder_ids = set()
     target_folder_ids = set()
 
-    for page_number in range(1, number_of_pages + 1):
-        doc_cfvs: list[DocumentCFV] = db.get_docs_by_type(
-            db_session,
-            document_type_id,
-            page_number=page_number,
-            page_size=page_size,
-        )
-        updates = []
-
-        for doc_cfv in doc_cfvs:
-            custom_fields = [
-                CField(name=cf[0], value=cf[1]) for cf in doc_cfv.custom_fields
-            ]
-            ctx = DocumentContext(
-                id=doc_cfv.id, title=doc_cfv.title, custom_fields=custom_fields
+    checkpoint = checkpoints.get(dtype.id) if checkpoints and resume else None
+    if (
+        checkpoint
+        and checkpoint.run_id == run_id
+        and checkpoint.template_fingerprint == fingerprint
+    ):
+        after_id = checkpoint.last_document_id
+        total_moved = checkpoint.count
+        total_unchanged = checkpoint.unchanged_count
+
+    while True:
+        if on_page:
+            on_page(
+                db.get_page_last_id(
+                    db_session,
+                    dtype.id,
+                    limit=PAGE_SIZE,
+                    after_id=after_id,
+                    until_id=until_id,
+                )
             )
-            ev_path = get_evaluated_path(ctx, dtype.path_template)
-            source_folder_ids.add(doc_cfv.parent_id)
-            updates.append(
-                BulkUpdate(document_id=ctx.id, ev_path=ev_path, title=ctx.title)
+        records = TimedIterator(
+            db.stream_doc_records(
+                db_session,
+                dtype.id,
+                after_id=after_id,
+                limit=PAGE_SIZE,
+                until_id=until_id,
+                cf_names=deps.cf_names,
             )
+        )
+        started = time.perf_counter()
+        updates = [
+            DocumentUpdate(record.id, ev_path, record.title, record.parent_id)
+            for record, ev_path in evaluate(records)
+        ]
+        # fetching and evaluation are interleaved
+        metrics.STAGE_SECONDS.observe("fetch_cfv", records.elapsed)
+        metrics.STAGE_SECONDS.observe(
+            "evaluate", time.perf_counter() - started - records.elapsed
+        )
+        metrics.DOCUMENTS_EVALUATED.inc(len(updates))
 
-        target_folder_ids.update(
-            apply_updates(
-                db_session, updates, user_id=dtype.user_id, group_id=dtype.group_id
-            )
+        # stream is exhausted at this point, thus updates may be committed
+        moves = apply_updates(
+            db_session,
+            updates,
+            user_id=dtype.user_id,
+            group_id=dtype.group_id,
+            resolver=resolver,
         )
-        total_moved += len(updates)
+        for source_folder_id, target_folder_id in moves:
+            source_folder_ids.add(source_folder_id)
+            target_folder_ids.add(target_folder_id)
+        total_moved += len(moves)
+        total_unchanged += len(updates) - len(moves)
+        with metrics.stage("commit"):
+            db_session.commit()
+
+        if len(updates) < PAGE_SIZE:
+            break
+
+        after_id = updates[-1].document_id
+        if checkpoints:
+            checkpoints.save(
+                dtype.id,
+                MoveCheckpoint(
+                    run_id=run_id,
+                    template_fingerprint=fingerprint,
+                    last_document_id=after_id,
+                    count=total_moved,
+                    unchanged_count=total_unchanged,
+                ),
+            )
+
+    if checkpoints:
+        checkpoints.delete(dtype.id)
 
-    db_session.commit()
     return DocumentsMovedNotification(
         source_folder_ids=source_folder_ids,
         target_folder_ids=target_folder_ids,
         count=total_moved,
+        unchanged_count=total_unchanged,
         document_type_name=dtype.name,
         document_type_id=dtype.id,
     )
 
 
+def _plan_move_documents(
+    db_session: Session,
+    dtype: DocumentType,
+    evaluate: Evaluate,
+    on_move: Callable[[PlannedMove], None] | None = None,
+) -> MovePlan:
+    resolver = db.FolderResolver()
+    deps = template_cache.get_compiled_template(dtype.path_template).deps
+    # folder ID -> absolute path of current parents of documents
+    folder_paths: dict[uuid.UUID, str] = {}
+    plan = MovePlan(document_type_id=dtype.id, document_type_name=dtype.name)
+    after_id = None
+
+    while True:
+        updates = [
+            DocumentUpdate(record.id, ev_path, record.title, record.parent_id)
+            for record, ev_path in evaluate(
+                db.stream_doc_records(
+                    db_session,
+                    dtype.id,
+                    after_id=after_id,
+                    limit=PAGE_SIZE,
+                    cf_names=deps.cf_names,
+                )
+            )
+        ]
+        folder_ids, folders_count = db.plan_mkdir_many(
+            db_session,
+            [item.ev_path.strip() for item in updates],
+            user_id=dtype.user_id,
+            group_id=dtype.group_id,
+            resolver=resolver,
+        )
+        plan.folders_count += folders_count
+        folder_paths.update(
+            db.get_folder_paths(
+                db_session,
+                {item.parent_id for item in updates} - folder_paths.keys(),
+            )
+        )
+
+        for item in updates:
+            stripped_ev_path = item.ev_path.strip()
+            target_folder_id = folder_ids[stripped_ev_path]
+            new_title = target_title(stripped_ev_path, item.title)
+            moved = not (
+                target_folder_id is not None
+                and item.parent_id == target_folder_id
+                and item.title == new_title
+            )
+            if moved:
+                plan.count += 1
+            else:
+                plan.unchanged_count += 1
+            if on_move:
+                on_move(
+                    PlannedMove(
+                        document_id=item.document_id,
+                        old_path=folder_paths.get(item.parent_id, "/") + item.title,
+                        new_path=folder_path(stripped_ev_path) + new_title,
+                        moved=moved,
+                    )
+                )
+
+        if len(updates) < PAGE_SIZE:
+            break
+
+        after_id = updates[-1].document_id
+
+    return plan
+
+
+def target_title(stripped_ev_path: str, title: str) -> str:
+    """Returns title of the document moved to the evaluated path"""
+    if stripped_ev_path.endswith("/"):
+        # title does not change
+        return title
+
+    return PurePath(stripped_ev_path).name
+
+
+def folder_path(stripped_ev_path: str) -> str:
+    """Returns absolute path of the target folder of the evaluated path"""
+    segments = db.path_segments(stripped_ev_path)
+
+    return f"/{constants.HOME_TITLE}/" + "".join(f"{title}/" for title in segments)
+
+
+def merge_notifications(
+    notifications: Iterable[DocumentsMovedNotification],
+) -> DocumentsMovedNotification:
+    """Merges notifications of chunks of the same bulk move into one"""
+    notifications = list(notifications)
+    source_folder_ids = set()
+    target_folder_ids = set()
+    for item in notifications:
+        source_folder_ids.update(item.source_folder_ids)
+        target_folder_ids.update(item.target_folder_ids)
+
+    return DocumentsMovedNotification(
+        source_folder_ids=source_folder_ids,
+        target_folder_ids=target_folder_ids,
+        count=sum(item.count for item in notifications),
+        unchanged_count=sum(item.unchanged_count for item in notifications),
+        document_type_name=notifications[0].document_type_name,
+        document_type_id=notifications[0].document_type_id,
+    )
+
+
+class TimedIterator:
+    """Wraps iterator; `elapsed` is the time spent in getting its items"""
+
+    def __init__(self, items: Iterable):
+        self._items = iter(items)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._items)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+
+def evaluate_documents(
+    records: Iterable[DocumentRecord], compiled: template_cache.CompiledTemplate
+) -> Iterator[tuple[DocumentRecord, str]]:
+    """Yields each document together with its evaluated path"""
+    for record in records:
+        ctx = TemplateContext.from_record(record)
+        yield record, template_cache.evaluate(compiled, ctx)
+
+
 def apply_updates(
     db_session: Session,
-    updates: list[BulkUpdate],
+    updates: list[BulkUpdate | DocumentUpdate],
     user_id: uuid.UUID | None = None,
     group_id: uuid.UUID | None = None,
-) -> list[uuid.UUID]:
+    resolver: db.FolderResolver | None = None,
+) -> list[Move]:
+    """Moves documents to their evaluated paths
+
+    Folders are created as needed. Documents whose current `parent_id` is
+    known and which already have the evaluated parent and title are skipped.
+    Returns (source folder id, target folder id) of each updated document.
+    """
     if len(updates) < 1:
         return []
 
-    target_folder_ids = []
+    if resolver is None:
+        resolver = db.FolderResolver()
+
+    with metrics.stage("mkdir"):
+        folder_ids = db.mkdir_many(
+            db_session,
+            [item.ev_path.strip() for item in updates],
+            user_id=user_id,
+            group_id=group_id,
+            resolver=resolver,
+        )
+    moves = []
     update_values = []
     for item in updates:
         stripped_ev_path = item.ev_path.strip()
-        target_folder = db.mkdir(
-            db_session, stripped_ev_path, user_id=user_id, group_id=group_id
-        )
-        if stripped_ev_path.endswith("/"):
-            v = {
-                "id": item.document_id,
-                "parent_id": target_folder.id,
-                "title": item.title,
-            }
-        else:
-            v = {
+        target_folder_id = folder_ids[stripped_ev_path]
+        new_title = target_title(stripped_ev_path, item.title)
+
+        if item.parent_id == target_folder_id and item.title == new_title:
+            # no-op move
+            continue
+
+        update_values.append(
+            {
                 "id": item.document_id,
-                "parent_id": target_folder.id,
-                "title": PurePath(stripped_ev_path).name,
+                "parent_id": target_folder_id,
+                "title": new_title,
             }
-        update_values.append(v)
-        target_folder_ids.append(target_folder.id)
+        )
+        moves.append((item.parent_id, target_folder_id))
 
-    db_session.execute(update(Document), update_values)
+    if update_values:
+        with metrics.stage("update"):
+            db_session.execute(update(Document), update_values)
 
-    return target_folder_ids
+    return moves
@@ -0,0 +1,126 @@
+"""Registry of pending bulk moves
+
+When path template of a document type changes, all its documents are
+moved by a bulk move, so single document moves of the same type queued
+meanwhile are redundant - unless the bulk move has already read the
+document, in which case the single move may reflect a later change.
+
+For each pending bulk move the registry keeps (in one Redis hash per
+document type) the time it was registered and, for each chunk of the
+move, the ID of the last document which the chunk has already read (or
+is reading right now). Single document move is superseded if its document
+is in a chunk which did not read it yet.
+"""
+
+import uuid
+from datetime import datetime, timezone
+
+import redis
+
+from path_tmpl_worker.coalesce import COUNTERS_KEY, SUPERSEDED
+
+BULK_KEY_PREFIX = "path_tmpl:bulk:"
+# seconds after which registration of abandoned bulk move is dropped
+BULK_TTL = 24 * 3600
+SINCE = "since"
+# chunk has read all its documents
+ALL_READ = "*"
+
+Bounds = tuple[uuid.UUID | None, uuid.UUID | None]
+
+
+def _field(bounds: Bounds) -> str:
+    after_id, until_id = bounds
+    return f"{after_id or ''}:{until_id or ''}"
+
+
+def _bounds(field: str) -> Bounds:
+    after_id, until_id = field.split(":")
+    return (
+        uuid.UUID(after_id) if after_id else None,
+        uuid.UUID(until_id) if until_id else None,
+    )
+
+
+def _in_bounds(document_id: uuid.UUID, bounds: Bounds) -> bool:
+    after_id, until_id = bounds
+    if after_id is not None and document_id <= after_id:
+        return False
+    if until_id is not None and document_id > until_id:
+        return False
+
+    return True
+
+
+class BulkMoveRegistry:
+    def __init__(self, client: redis.Redis, ttl: int = BULK_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    @staticmethod
+    def key(document_type_id: uuid.UUID | str) -> str:
+        return f"{BULK_KEY_PREFIX}{document_type_id}"
+
+    def start(self, document_type_id: uuid.UUID | str, chunks: list[Bounds]):
+        """Registers bulk move with given chunks; none of them read anything yet"""
+        mapping = {_field(bounds): "" for bounds in chunks}
+        mapping[SINCE] = datetime.now(timezone.utc).isoformat()
+        key = self.key(document_type_id)
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def advance(
+        self,
+        document_type_id: uuid.UUID | str,
+        chunk: Bounds,
+        last_id: uuid.UUID | None,
+    ):
+        """Marks documents of the chunk up to `last_id` as read
+
+        Called before the chunk starts reading them. None means till the
+        end of the chunk.
+        """
+        key = self.key(document_type_id)
+        pipe = self.client.pipeline()
+        pipe.hsetnx(key, SINCE, datetime.now(timezone.utc).isoformat())
+        pipe.hset(key, _field(chunk), str(last_id) if last_id else ALL_READ)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def finish(self, document_type_id: uuid.UUID | str, chunk: Bounds):
+        """Unregisters chunk; bulk move is unregistered with its last chunk"""
+        key = self.key(document_type_id)
+        self.client.hdel(key, _field(chunk))
+        if self.client.hlen(key) <= 1:
+            self.client.delete(key)
+
+    def pending_since(self, document_type_id: uuid.UUID | str) -> datetime | None:
+        value = self.client.hget(self.key(document_type_id), SINCE)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+
+        return datetime.fromisoformat(value)
+
+    def supersedes(
+        self, document_type_id: uuid.UUID | str | None, document_id: uuid.UUID
+    ) -> bool:
+        """Returns True if pending bulk move will read the document later"""
+        if document_type_id is None:
+            return False
+
+        items = self.client.hgetall(self.key(document_type_id))
+        for field, value in items.items():
+            if isinstance(field, bytes):
+                field, value = field.decode(), value.decode()
+            if field == SINCE or not _in_bounds(document_id, _bounds(field)):
+                continue
+            if value == ALL_READ or (value and document_id <= uuid.UUID(value)):
+                return False
+            self.client.hincrby(COUNTERS_KEY, SUPERSEDED, 1)
+            return True
+
+        return False
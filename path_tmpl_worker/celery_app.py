@@ -1,13 +1,22 @@
+import logging
+
+from billiard.process import current_process
 from celery import Celery
-from path_tmpl_worker import config, utils
-from celery.signals import setup_logging
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from path_tmpl_worker import config, metrics, utils
+from celery.signals import setup_logging, worker_init, worker_process_init
+from path_tmpl_worker.db.engine import reset_pool
 
 
+logger = logging.getLogger(__name__)
 settings = config.get_settings()
 
 app = Celery(
     "PathTmplWorker",
     broker=settings.papermerge__redis__url,
+    # needed by chords of bulk move chunks
+    backend=settings.papermerge__redis__url,
     include=["path_tmpl_worker.tasks"],
 )
 
@@ -16,6 +25,8 @@ app.autodiscover_tasks()
 # Optional configuration, see the application user guide.
 app.conf.update(
     result_expires=3600,
+    # only tasks which opt in (chunks of bulk moves) store their results
+    task_ignore_result=True,
     max_retries=3,
     broker_connection_retry_on_startup=False,
     interval_start=0,
@@ -30,5 +41,45 @@ def config_loggers(*args, **kwags):
         utils.setup_logging(settings.papermerge__main__logging_cfg)
 
 
+@worker_process_init.connect
+def reset_db_pool(*args, **kwargs):
+    # prefork: each child process gets its own connection pool
+    reset_pool()
+
+
+@worker_init.connect
+def check_eval_workers(sender=None, **kwargs):
+    if settings.papermerge__path_tmpl__eval_workers == 0:
+        return
+
+    # prefork pool processes are daemonic: they cannot start a process
+    # pool, thus `api.evaluator` falls back to serial evaluation
+    if issubclass(get_implementation(sender.pool_cls), PreforkPool):
+        logger.warning(
+            "papermerge__path_tmpl__eval_workers is ignored with prefork pool;"
+            " use --pool threads or --pool solo to evaluate path templates"
+            " in a process pool"
+        )
+
+
+@worker_init.connect
+def serve_metrics(*args, **kwargs):
+    if settings.papermerge__path_tmpl__metrics_port > 0:
+        metrics.start_http_server(
+            settings.papermerge__path_tmpl__metrics_port,
+            addr=settings.papermerge__path_tmpl__metrics_addr,
+        )
+
+
+@worker_process_init.connect
+def serve_child_metrics(*args, **kwargs):
+    if settings.papermerge__path_tmpl__metrics_port > 0:
+        index = getattr(current_process(), "index", 0)
+        metrics.start_http_server(
+            settings.papermerge__path_tmpl__metrics_port + 1 + index,
+            addr=settings.papermerge__path_tmpl__metrics_addr,
+        )
+
+
 if __name__ == "__main__":
     app.start()
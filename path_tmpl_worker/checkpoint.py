@@ -0,0 +1,71 @@
+"""Checkpoints of bulk document moves
+
+`api.move_documents` commits documents in chunks and after each chunk
+saves a checkpoint: ID of the run, ID of the last committed document and
+fingerprint of the path template. Interrupted run, when restarted with the
+same run ID (i.e. redelivered task), resumes after that document, provided
+the path template did not change in the meantime.
+"""
+
+import uuid
+from typing import Protocol
+
+import redis
+
+from path_tmpl_worker.models import MoveCheckpoint
+
+# seconds after which abandoned checkpoint is dropped; redelivery happens
+# well before (after `visibility_timeout` of the broker, 1h by default)
+CHECKPOINT_TTL = 24 * 3600
+CHECKPOINT_KEY_PREFIX = "path_tmpl:checkpoint:"
+
+
+class CheckpointStore(Protocol):
+    def get(self, document_type_id: uuid.UUID) -> MoveCheckpoint | None: ...
+
+    def save(self, document_type_id: uuid.UUID, checkpoint: MoveCheckpoint): ...
+
+    def delete(self, document_type_id: uuid.UUID): ...
+
+
+class MemoryCheckpointStore:
+    """Keeps checkpoints in process memory (CLI, tests)"""
+
+    def __init__(self):
+        self._items: dict[uuid.UUID, MoveCheckpoint] = {}
+
+    def get(self, document_type_id: uuid.UUID) -> MoveCheckpoint | None:
+        return self._items.get(document_type_id)
+
+    def save(self, document_type_id: uuid.UUID, checkpoint: MoveCheckpoint):
+        self._items[document_type_id] = checkpoint
+
+    def delete(self, document_type_id: uuid.UUID):
+        self._items.pop(document_type_id, None)
+
+
+class RedisCheckpointStore:
+    """Keeps checkpoints in Redis, so they survive worker restarts"""
+
+    def __init__(self, client: redis.Redis, ttl: int = CHECKPOINT_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    @staticmethod
+    def key(document_type_id: uuid.UUID) -> str:
+        return f"{CHECKPOINT_KEY_PREFIX}{document_type_id}"
+
+    def get(self, document_type_id: uuid.UUID) -> MoveCheckpoint | None:
+        value = self.client.get(self.key(document_type_id))
+        if value is None:
+            return None
+
+        return MoveCheckpoint.model_validate_json(value)
+
+    def save(self, document_type_id: uuid.UUID, checkpoint: MoveCheckpoint):
+        self.client.set(
+            self.key(document_type_id), checkpoint.model_dump_json(), ex=self.ttl
+        )
+
+    def delete(self, document_type_id: uuid.UUID):
+        self.client.delete(self.key(document_type_id))
@@ -1,8 +1,14 @@
+import asyncio
+import dataclasses
+import json
 import uuid
+from typing import Annotated
 
+import redis
 import typer
 
-from path_tmpl_worker import api
+from path_tmpl_worker import api, config
+from path_tmpl_worker.coalesce import Coalescer
 from path_tmpl_worker.db.engine import Session
 
 app = typer.Typer(help="CLI for Path Template worker")
@@ -15,6 +21,97 @@ def move_document(document_id: uuid.UUID):
 
 
 @app.command()
-def move_documents(document_type_id: uuid.UUID):
-    with Session as db_session:
-        api.move_documents(db_session, document_type_id)
+def move_documents(
+    document_type_id: uuid.UUID,
+    eval_workers: Annotated[
+        int, typer.Option(help="Evaluate path template in that many processes")
+    ] = 0,
+    eval_batch_size: Annotated[
+        int, typer.Option(help="Documents sent to evaluation process at once")
+    ] = api.EVAL_BATCH_SIZE,
+):
+    with Session() as db_session:
+        api.move_documents(
+            db_session,
+            document_type_id,
+            eval_workers=eval_workers,
+            eval_batch_size=eval_batch_size,
+        )
+
+
+@app.command()
+def move_many(
+    document_ids: Annotated[
+        list[uuid.UUID] | None, typer.Argument(help="Documents to move")
+    ] = None,
+    input: Annotated[
+        typer.FileText | None,
+        typer.Option(help="File with one document ID per line ('-' for stdin)"),
+    ] = None,
+    concurrency: Annotated[
+        int | None, typer.Option(help="Documents moved at the same time")
+    ] = None,
+):
+    """Move many documents concurrently on one event loop (without Celery)"""
+    # asyncio support needs greenlet, thus it is imported only here
+    from path_tmpl_worker.aio import AsyncRunner
+    from path_tmpl_worker.db.engine import get_async_engine
+
+    def ids():
+        yield from document_ids or []
+        for line in input or []:
+            if line.strip():
+                yield uuid.UUID(line.strip())
+
+    async def run(runner: "AsyncRunner"):
+        try:
+            await runner.run(ids())
+        finally:
+            await get_async_engine().dispose()
+
+    runner = AsyncRunner(concurrency=concurrency)
+    asyncio.run(run(runner))
+    print(f"moved: {runner.moved}, skipped: {runner.skipped}, failed: {runner.failed}")
+
+
+@app.command()
+def plan_move_documents(
+    document_type_id: uuid.UUID,
+    output: Annotated[
+        typer.FileTextWrite, typer.Option(help="JSONL file of planned moves")
+    ] = "-",
+    eval_workers: Annotated[
+        int, typer.Option(help="Evaluate path template in that many processes")
+    ] = 0,
+    eval_batch_size: Annotated[
+        int, typer.Option(help="Documents sent to evaluation process at once")
+    ] = api.EVAL_BATCH_SIZE,
+):
+    """Show where documents would be moved, without moving them
+
+    Writes one JSON line (document_id, old_path, new_path, moved) per
+    document; summary goes to stderr.
+    """
+
+    def write(entry):
+        output.write(json.dumps(dataclasses.asdict(entry), default=str) + "\n")
+
+    with Session() as db_session:
+        plan = api.plan_move_documents(
+            db_session,
+            document_type_id,
+            on_move=write,
+            eval_workers=eval_workers,
+            eval_batch_size=eval_batch_size,
+        )
+    typer.echo(plan.model_dump_json(), err=True)
+
+
+@app.command()
+def counters():
+    """Show number of coalesced, executed, superseded and unaffected moves"""
+    settings = config.get_settings()
+    client = redis.from_url(settings.papermerge__redis__url)
+    coalescer = Coalescer(client, settings.papermerge__path_tmpl__coalesce_window)
+    for name, value in coalescer.counters().items():
+        print(f"{name}: {value}")
@@ -0,0 +1,74 @@
+"""Coalescing of `move_document` requests
+
+Editing several custom fields of one document in quick succession queues
+several `move_document` tasks for the same document. Instead of moving
+the document on each of them, the first request schedules one deferred
+move, `window` seconds later; requests arriving until that move starts
+are merged into it. As the deferred move reads the document from DB when
+it runs, it evaluates the latest state of the document.
+"""
+
+import uuid
+
+import redis
+
+COALESCE_KEY_PREFIX = "path_tmpl:pending:move_document:"
+COUNTERS_KEY = "path_tmpl:counters"
+COALESCED = "move_document_coalesced"
+EXECUTED = "move_document_executed"
+# skipped because of pending bulk move (see `bulk_registry`)
+SUPERSEDED = "move_document_superseded"
+# skipped because changed custom fields are not used by path template
+UNAFFECTED = "move_document_unaffected"
+
+
+class Coalescer:
+    def __init__(self, client: redis.Redis, window: float):
+        self.client = client
+        self.window = window
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    @staticmethod
+    def key(document_id: uuid.UUID | str) -> str:
+        return f"{COALESCE_KEY_PREFIX}{document_id}"
+
+    def claim(self, document_id: uuid.UUID | str) -> bool:
+        """Marks move of the document as pending
+
+        Returns False if there is a pending move of the document already,
+        i.e. the request was merged into it.
+        """
+        # key outlives the window, so that a lost deferred move does not
+        # block the document forever, nor frees it too early
+        ttl_ms = int(self.window * 2000) + 1000
+        if self.client.set(self.key(document_id), 1, nx=True, px=ttl_ms):
+            return True
+
+        self.client.hincrby(COUNTERS_KEY, COALESCED, 1)
+        return False
+
+    def start(self, document_id: uuid.UUID | str):
+        """Called when deferred move starts
+
+        Requests arriving from now on schedule a new move, as they may
+        reflect changes made after the document was read.
+        """
+        self.client.delete(self.key(document_id))
+
+    def executed(self):
+        """Counts document move which was actually carried out"""
+        self.client.hincrby(COUNTERS_KEY, EXECUTED, 1)
+
+    def counters(self) -> dict[str, int]:
+        """Returns number of coalesced, executed, superseded and unaffected moves"""
+        values = self.client.hgetall(COUNTERS_KEY)
+        result = {COALESCED: 0, EXECUTED: 0, SUPERSEDED: 0, UNAFFECTED: 0}
+        for name, value in values.items():
+            if isinstance(name, bytes):
+                name = name.decode()
+            result[name] = int(value)
+
+        return result
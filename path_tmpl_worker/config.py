@@ -8,6 +8,44 @@ class Settings(BaseSettings):
     papermerge__redis__url: str | None = None
     papermerge__main__logging_cfg: Path | None = None
     papermerge__database__url: str = "sqlite:////db/db.sqlite3"
+    # connections kept open per worker process; 0 = open new connection for
+    # each session (no pooling). Not used for SQLite
+    papermerge__database__pool_size: int = 5
+    # connections opened on top of `pool_size` under load, closed when returned
+    papermerge__database__max_overflow: int = 5
+    # test connection before handing it out (survives DB restarts)
+    papermerge__database__pool_pre_ping: bool = True
+    # seconds after which pooled connection is replaced; -1 = never
+    papermerge__database__pool_recycle: int = 1800
+    # number of processes evaluating path templates of bulk moves;
+    # 0 = evaluate in worker process itself. Process pool cannot be used
+    # with Celery prefork pool (use e.g. `--pool threads`); there templates
+    # are evaluated serially
+    papermerge__path_tmpl__eval_workers: int = 0
+    # number of documents sent to evaluation process at once
+    papermerge__path_tmpl__eval_batch_size: int = 250
+    # number of documents moved concurrently by the asyncio runner (see
+    # `aio.AsyncRunner`); keep within `pool_size` + `max_overflow`
+    papermerge__path_tmpl__async_concurrency: int = 10
+    # bulk moves of more documents are split into chunks of that many
+    # documents, moved by parallel subtasks; 0 = do not split
+    papermerge__path_tmpl__chunk_size: int = 0
+    # seconds during which repeated moves of the same document are merged
+    # into one; 0 = move document on each request
+    papermerge__path_tmpl__coalesce_window: float = 0
+    # notifications are published in batches of up to that many events...
+    papermerge__path_tmpl__notify_batch_size: int = 100
+    # ...or after that many seconds; 0 = publish each event right away
+    papermerge__path_tmpl__notify_max_delay: float = 0.25
+    # publish one `folder_documents_moved` event instead of several `document_moved`
+    # events with the same source and target folder
+    papermerge__path_tmpl__notify_collapse: bool = False
+    # serve metrics over HTTP on that port; 0 = do not serve. Prefork child
+    # processes serve their metrics on the following ports (port + 1 + index)
+    papermerge__path_tmpl__metrics_port: int = 0
+    papermerge__path_tmpl__metrics_addr: str = "0.0.0.0"
+    # log number, time and most frequent SQL statements of each task
+    papermerge__path_tmpl__record_queries: bool = False
 
 
 @lru_cache()
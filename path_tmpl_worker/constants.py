@@ -5,7 +5,14 @@ HOME_TITLE = "home"
 CTYPE_FOLDER = "folder"
 PATH_TMPL_MOVE_DOCUMENT = "path_tmpl_move_document"
 PATH_TMPL_MOVE_DOCUMENTS = "path_tmpl_move_documents"
+# one chunk of a bulk move fanned out by `path_tmpl_move_documents`
+PATH_TMPL_MOVE_DOCUMENTS_CHUNK = "path_tmpl_move_documents_chunk"
+# collects results of all chunks of a bulk move
+PATH_TMPL_MOVE_DOCUMENTS_DONE = "path_tmpl_move_documents_done"
+PATH_TMPL_QUEUE = "path_tmpl"
 # plural i.e. multilpe documents were moved
 NOTIF_DOCUMENTS_MOVED = "documents_moved"
 # singular i.e. one document was moved
 NOTIF_DOCUMENT_MOVED = "document_moved"
+# several `document_moved` events with the same source and target folder
+NOTIF_FOLDER_DOCUMENTS_MOVED = "folder_documents_moved"
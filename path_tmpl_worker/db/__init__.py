@@ -1,5 +1,6 @@
 from .base import Base
 from .engine import get_engine
+from .folder_resolver import FolderResolver
 from .api import (
     get_doc_ctx,
     get_doc_cfv,
@@ -8,14 +9,23 @@ from .api import (
     mkdir_target,
     document_type_cf_count,
     get_document_type,
+    get_path_template,
     get_docs_count_by_type,
     get_docs_by_type,
+    stream_doc_records,
+    get_chunk_bounds,
+    get_page_last_id,
     mkdir,
+    mkdir_many,
+    plan_mkdir_many,
+    get_folder_paths,
+    path_segments,
 )
 
 __all__ = [
     "Base",
     "get_engine",
+    "FolderResolver",
     "get_doc_ctx",
     "get_doc_cfv",
     "update_doc_cfv",
@@ -23,7 +33,15 @@ __all__ = [
     "mkdir_target",
     "document_type_cf_count",
     "get_document_type",
+    "get_path_template",
     "get_docs_count_by_type",
     "get_docs_by_type",
+    "stream_doc_records",
+    "get_chunk_bounds",
+    "get_page_last_id",
     "mkdir",
+    "mkdir_many",
+    "plan_mkdir_many",
+    "get_folder_paths",
+    "path_segments",
 ]
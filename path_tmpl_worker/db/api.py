@@ -1,14 +1,33 @@
+import json
 import uuid
 from datetime import datetime
 from pathlib import PurePath
-from sqlalchemy import select, insert, update, func, Select, VARCHAR, case
+from sqlalchemy import (
+    select,
+    insert,
+    update,
+    func,
+    literal,
+    literal_column,
+    ColumnElement,
+    Select,
+    Insert,
+    Integer,
+    Uuid,
+    VARCHAR,
+    case,
+)
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session, aliased
-from typing import Optional, Tuple
+from itertools import batched
+from typing import Callable, Collection, Iterable, Iterator, Optional, Tuple
 
-from pathtmpl import get_evaluated_path, DocumentContext, CField
+from pathtmpl import DocumentContext, CField
 
-from path_tmpl_worker.ordered_document_cfv import OrderedDocumentCFV
-from path_tmpl_worker import models
+from path_tmpl_worker.ordered_document_cfv import convert_cf_value
+from path_tmpl_worker import metrics, models, template_cache
+from path_tmpl_worker.records import DocumentRecord
 from path_tmpl_worker.constants import INCOMING_DATE_FORMAT, CTYPE_FOLDER
 from path_tmpl_worker.db.orm import (
     Document,
@@ -19,11 +38,24 @@ from path_tmpl_worker.db.orm import (
     DocumentType,
     DocumentTypeCustomField,
     Group,
+    Node,
 )
+from path_tmpl_worker.db.folder_resolver import FolderResolver, FolderNode
+from path_tmpl_worker.db.functions import json_object_agg
 
 
 # len(2024-11-02) + 1
 DATE_LEN = 11
+# number of rows fetched at once when streaming documents
+STREAM_BATCH_SIZE = 1000
+# path parts which refer to user's/group's home folder
+HOME_NAMES = ("home", ".home")
+# path parts which do not create any folder
+SKIP_NAMES = ("", *HOME_NAMES)
+# max number of (parent, title) pairs per folder lookup query
+MKDIR_LOOKUP_BATCH_SIZE = 500
+# max number of folders per multi-row INSERT statement
+MKDIR_INSERT_BATCH_SIZE = 500
 
 
 def document_type_cf_count(session: Session, document_type_id: uuid.UUID):
@@ -44,7 +76,15 @@ def get_docs_count_by_type(session: Session, type_id: uuid.UUID):
     return session.scalars(stmt).one()
 
 
-def _select_cf() -> Select:
+def select_cf_by_document_type(
+    document_type_id: uuid.UUID, cf_names: Collection[str] | None = None
+) -> Select:
+    """Returns SqlAlchemy selector for custom fields of document type
+
+    Custom fields are read from the association table only, thus cost of
+    the selector does not depend on number of documents of the type.
+    If `cf_names` is given, only custom fields with these names are selected.
+    """
     stmt = (
         select(
             CustomField.id,
@@ -52,142 +92,274 @@ def _select_cf() -> Select:
             CustomField.type,
             CustomField.extra_data,
         )
-        .select_from(Document)
-        .join(
-            DocumentTypeCustomField,
-            DocumentTypeCustomField.document_type_id == Document.document_type_id,
-        )
+        .select_from(DocumentTypeCustomField)
         .join(
             CustomField,
             CustomField.id == DocumentTypeCustomField.custom_field_id,
         )
+        .where(DocumentTypeCustomField.document_type_id == document_type_id)
     )
+    if cf_names is not None:
+        stmt = stmt.where(CustomField.name.in_(list(cf_names)))
 
     return stmt
 
 
-def select_cf_by_document_type(document_type_id: uuid.UUID) -> Select:
-    """Returns SqlAlchemy selector for document custom fields"""
-    stmt = (
-        _select_cf()
-        .where(Document.document_type_id == document_type_id)
-        .group_by(CustomField.id)
+def select_cf_value(cf, cfv) -> ColumnElement:
+    """Returns custom field value (as string) of custom field type `cf.c.type`"""
+    return case(
+        (cf.c.type == "monetary", func.cast(cfv.value_monetary, VARCHAR)),
+        (cf.c.type == "text", func.cast(cfv.value_text, VARCHAR)),
+        (
+            cf.c.type == "date",
+            func.substr(func.cast(cfv.value_date, VARCHAR), 0, DATE_LEN),
+        ),
+        (cf.c.type == "boolean", func.cast(cfv.value_boolean, VARCHAR)),
     )
 
-    return stmt
 
+def select_doc_ids_by_type(
+    document_type_id: uuid.UUID,
+    limit: int | None,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+) -> Select:
+    """Returns SqlAlchemy selector for one page of document IDs of given type
+
+    Keyset (seek) pagination: IDs are ordered and the page starts right
+    after `after_id`, so cost of each page does not depend on its depth.
+    If `limit` is None the page extends till the last document, or till
+    `until_id` (inclusive) if given.
+    """
+    stmt = select(Document.id.label("id")).where(
+        Document.document_type_id == document_type_id
+    )
+    if after_id is not None:
+        stmt = stmt.where(Document.id > after_id)
+    if until_id is not None:
+        stmt = stmt.where(Document.id <= until_id)
+
+    return stmt.order_by(Document.id).limit(limit)
 
-def select_docs_by_type(
+
+def get_page_last_id(
+    session: Session,
     document_type_id: uuid.UUID,
     limit: int,
-    offset: int,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+) -> uuid.UUID | None:
+    """Returns ID of the last document of the page, without reading the page
+
+    Returns None if the page is not full, i.e. it is the last page.
+    """
+    stmt = select_doc_ids_by_type(
+        document_type_id, limit=1, after_id=after_id, until_id=until_id
+    ).offset(limit - 1)
+
+    return session.scalars(stmt).first()
+
+
+def select_chunk_last_ids(document_type_id: uuid.UUID, chunk_size: int) -> Select:
+    """Returns SqlAlchemy selector for IDs of every `chunk_size`-th document
+
+    Documents of given type are ordered by ID; ID of the very last document
+    is not included.
+    """
+    numbered = (
+        select(
+            Document.id.label("id"),
+            func.row_number().over(order_by=Document.id).label("num"),
+            func.count().over().label("total"),
+        )
+        .where(Document.document_type_id == document_type_id)
+        .subquery("numbered")
+    )
+
+    return (
+        select(numbered.c.id)
+        .where(numbered.c.num % chunk_size == 0)
+        .where(numbered.c.num < numbered.c.total)
+        .order_by(numbered.c.id)
+    )
+
+
+def get_chunk_bounds(
+    session: Session, document_type_id: uuid.UUID, chunk_size: int
+) -> list[Tuple[uuid.UUID | None, uuid.UUID | None]]:
+    """Splits documents of given type into chunks of `chunk_size` documents
+
+    Each chunk is returned as (after_id, until_id) pair: chunk contains
+    documents with ID greater than `after_id` and less or equal to `until_id`
+    (None = no bound). Last chunk is open ended, so documents added in the
+    meantime are not missed.
+    """
+    last_ids = session.scalars(select_chunk_last_ids(document_type_id, chunk_size))
+    bounds = []
+    after_id = None
+    for last_id in last_ids:
+        bounds.append((after_id, last_id))
+        after_id = last_id
+    bounds.append((after_id, None))
+
+    return bounds
+
+
+def select_docs_by_type_pivoted(
+    document_type_id: uuid.UUID,
+    limit: int | None,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    cf_names: Collection[str] | None = None,
 ) -> Select:
+    """Returns SqlAlchemy selector for one page of documents with custom field values
+
+    There is one row per document: all custom field values of the document
+    are aggregated into one JSON object (custom field name -> value)
+    labeled `cf_values`; `limit` is the number of documents in the page.
+    With `cf_names` only these custom fields are included; they must not
+    be empty. Rows are ordered by document ID.
+    """
     assoc = aliased(DocumentTypeCustomField, name="assoc")
     doc = aliased(Document, name="doc")
-    cf = select_cf_by_document_type(document_type_id).subquery("cf")
+    cf = select_cf_by_document_type(document_type_id, cf_names).subquery("cf")
     cfv = aliased(CustomFieldValue, name="cfv")
+    page = select_doc_ids_by_type(
+        document_type_id, limit, after_id=after_id, until_id=until_id
+    ).subquery("page")
 
-    base_stmt = (
+    stmt = (
         select(
             doc.title,
             doc.id.label("doc_id"),
             doc.document_type_id.label("document_type_id"),
             doc.parent_id,
-            cf.c.name.label("cf_name"),
-            cf.c.type.label("cf_type"),
-            case(
-                (cf.c.type == "monetary", func.cast(cfv.value_monetary, VARCHAR)),
-                (cf.c.type == "text", func.cast(cfv.value_text, VARCHAR)),
-                (
-                    cf.c.type == "date",
-                    func.substr(func.cast(cfv.value_date, VARCHAR), 0, DATE_LEN),
-                ),
-                (cf.c.type == "boolean", func.cast(cfv.value_boolean, VARCHAR)),
-            ).label("cf_value"),
+            json_object_agg(cf.c.name, select_cf_value(cf, cfv)).label("cf_values"),
         )
         .select_from(doc)
+        .join(page, page.c.id == doc.id)
         .join(assoc, assoc.document_type_id == doc.document_type_id)
         .join(cf, cf.c.id == assoc.custom_field_id)
         .join(
             cfv, (cfv.field_id == cf.c.id) & (cfv.document_id == doc.id), isouter=True
         )
+        .group_by(doc.id, doc.title, doc.document_type_id, doc.parent_id)
+        .order_by(doc.id)
     )
 
-    stmt = base_stmt.where(doc.document_type_id == document_type_id)
-    return stmt.limit(limit).offset(offset)
+    return stmt
 
 
-def get_docs_by_type_no_cf(
+def get_docs_by_type(
     session: Session,
-    type_id: uuid.UUID,
-    limit: int,
-    offset: int,
+    document_type_id: uuid.UUID,
+    page_size: int = 300,
+    after_id: uuid.UUID | None = None,
 ) -> list[models.DocumentCFV]:
-    """Return all documents of specific type (with their empty custom fields)
+    """Returns documents of given type with ID greater than `after_id`
 
-    This method works correctly only in case document type does
-    not have custom fields
+    At most `page_size` documents are returned, ordered by document ID.
+    Pass ID of the last returned document as `after_id` to get next page.
+    Documents are read with `stream_doc_records`, one row per document.
     """
-    stmt = (
-        select(Document)
-        .where(Document.document_type_id == type_id)
-        .limit(limit)
-        .offset(offset)
-    )
+    return [
+        models.DocumentCFV(
+            id=record.id,
+            title=record.title,
+            parent_id=record.parent_id,
+            document_type_id=record.document_type_id,
+            custom_fields=record.custom_fields,
+        )
+        for record in stream_doc_records(
+            session, document_type_id, after_id=after_id, limit=page_size
+        )
+    ]
 
-    results = []
 
-    for doc in session.execute(stmt).scalars():
-        item = models.DocumentCFV(
-            id=doc.id,
-            title=doc.title,
-            parent_id=doc.parent_id,
-            document_type_id=type_id,
-            custom_fields=[],
+def get_cf_types(session: Session, document_type_id: uuid.UUID) -> dict[str, str]:
+    """Returns custom field types (by custom field name) of the document type"""
+    stmt = (
+        select(CustomField.name, CustomField.type)
+        .join(
+            DocumentTypeCustomField,
+            DocumentTypeCustomField.custom_field_id == CustomField.id,
         )
-        results.append(item)
+        .where(DocumentTypeCustomField.document_type_id == document_type_id)
+    )
 
-    return results
+    return {row.name: row.type for row in session.execute(stmt)}
 
 
-def get_docs_by_type(
+def stream_doc_records(
     session: Session,
     document_type_id: uuid.UUID,
-    page_number: int = 1,
-    page_size: int = 300,
-) -> list[models.DocumentCFV]:
-
-    cf_count = document_type_cf_count(session, document_type_id=document_type_id)
+    after_id: uuid.UUID | None = None,
+    limit: int | None = None,
+    until_id: uuid.UUID | None = None,
+    cf_names: Collection[str] | None = None,
+) -> Iterator[DocumentRecord]:
+    """Streams documents of given type with ID greater than `after_id`
+
+    If `until_id` is given, documents with greater ID are not included.
+    Documents are ordered by ID. There is one row per document (see
+    `select_docs_by_type_pivoted`). Rows are fetched with a server side
+    cursor, `STREAM_BATCH_SIZE` rows at a time, thus memory usage does not
+    depend on the number of documents. Session must not be committed before
+    the stream is exhausted (commit closes the cursor).
+
+    With `cf_names` (e.g. the ones referenced by path template, see
+    `template_deps`) only these custom fields are fetched.
+    """
+    cf_types = get_cf_types(session, document_type_id)
+    if cf_names is not None:
+        cf_types = {
+            name: cf_type for name, cf_type in cf_types.items() if name in cf_names
+        }
+    options = {"yield_per": STREAM_BATCH_SIZE}
+
+    if len(cf_types) == 0:
+        stmt = select(
+            Document.id, Document.title, Document.parent_id, Document.document_type_id
+        ).where(Document.document_type_id == document_type_id)
+        if after_id is not None:
+            stmt = stmt.where(Document.id > after_id)
+        if until_id is not None:
+            stmt = stmt.where(Document.id <= until_id)
+        stmt = stmt.order_by(Document.id).limit(limit)
+
+        for row in session.execute(stmt, execution_options=options):
+            yield DocumentRecord(row[0], row[1], row[2], row[3], [])
+        return
+
+    stmt = select_docs_by_type_pivoted(
+        document_type_id,
+        limit=limit,
+        after_id=after_id,
+        until_id=until_id,
+        cf_names=cf_names,
+    )
 
-    if cf_count == 0:
-        return get_docs_by_type_no_cf(
-            session,
-            type_id=document_type_id,
-            limit=page_size,
-            offset=(page_number - 1) * page_size,
-        )
+    for title, doc_id, type_id, parent_id, cf_values in session.execute(
+        stmt, execution_options=options
+    ):
+        if isinstance(cf_values, (str, bytes)):
+            # SQLite returns JSON as text
+            cf_values = json.loads(cf_values)
+
+        custom_fields = []
+        for name in sorted(cf_values):
+            cf_type = cf_types[name]
+            custom_fields.append(
+                (name, convert_cf_value(cf_type, cf_values[name]), cf_type)
+            )
 
-    stmt = select_docs_by_type(
-        document_type_id=document_type_id,
-        limit=cf_count * page_size,
-        offset=cf_count * (page_number - 1) * page_size,
-    )
-    rows = session.execute(stmt)
-
-    ordered_doc_cfvs = OrderedDocumentCFV()
-    for row in rows:
-        entry = models.DocumentCFVRow(
-            title=row.title,
-            doc_id=row.doc_id,
-            parent_id=row.parent_id,
-            document_type_id=row.document_type_id,
-            cf_name=row.cf_name,
-            cf_type=row.cf_type,
-            cf_value=row.cf_value,
+        yield DocumentRecord(
+            title=title,
+            id=doc_id,
+            parent_id=parent_id,
+            document_type_id=type_id,
+            custom_fields=custom_fields,
         )
-        ordered_doc_cfvs.add(entry)
-
-    return list(ordered_doc_cfvs)
 
 
 def get_document_type(session: Session, document_type_id: uuid.UUID) -> DocumentType:
@@ -207,7 +379,9 @@ def get_path_template(session: Session, document_id: uuid.UUID) -> str:
     return path_template
 
 
-def select_cf_by_document_id(document_id: uuid.UUID) -> Select:
+def select_cf_by_document_id(
+    document_id: uuid.UUID, cf_names: Collection[str] | None = None
+) -> Select:
     stmt = (
         select(
             CustomField.id, CustomField.name, CustomField.type, CustomField.extra_data
@@ -219,13 +393,20 @@ def select_cf_by_document_id(document_id: uuid.UUID) -> Select:
         )
         .join(CustomField, CustomField.id == DocumentTypeCustomField.custom_field_id)
     ).where(Document.id == document_id)
+    if cf_names is not None:
+        stmt = stmt.where(CustomField.name.in_(list(cf_names)))
 
     return stmt
 
 
-def select_doc_cfv(document_id: uuid.UUID) -> Select:
-    """Returns SqlAlchemy selector for document custom field values"""
-    cf = select_cf_by_document_id(document_id).subquery("cf")
+def select_doc_cfv(
+    document_id: uuid.UUID, cf_names: Collection[str] | None = None
+) -> Select:
+    """Returns SqlAlchemy selector for document custom field values
+
+    If `cf_names` is given, only custom fields with these names are selected.
+    """
+    cf = select_cf_by_document_id(document_id, cf_names).subquery("cf")
     cfv = aliased(CustomFieldValue, name="cfv")
     assoc = aliased(DocumentTypeCustomField, name="assoc")
     doc = aliased(Document, name="doc")
@@ -239,15 +420,7 @@ def select_doc_cfv(document_id: uuid.UUID) -> Select:
             cf.c.type.label("cf_type"),
             cf.c.id.label("cf_id"),
             cfv.id.label("cfv_id"),
-            case(
-                (cf.c.type == "monetary", func.cast(cfv.value_monetary, VARCHAR)),
-                (cf.c.type == "text", func.cast(cfv.value_text, VARCHAR)),
-                (
-                    cf.c.type == "date",
-                    func.substr(func.cast(cfv.value_date, VARCHAR), 0, DATE_LEN),
-                ),
-                (cf.c.type == "boolean", func.cast(cfv.value_boolean, VARCHAR)),
-            ).label("cf_value"),
+            select_cf_value(cf, cfv).label("cf_value"),
         )
         .select_from(doc)
         .join(assoc, assoc.document_type_id == doc.document_type_id)
@@ -258,13 +431,22 @@ def select_doc_cfv(document_id: uuid.UUID) -> Select:
             isouter=True,
         )
         .where(doc.id == document_id)
+        # same order as on bulk move path (see `stream_doc_records`)
+        .order_by(cf.c.name)
     )
 
     return stmt
 
 
-def get_doc_cfv(session: Session, document_id: uuid.UUID) -> list[models.CFV]:
-    stmt = select_doc_cfv(document_id)
+def get_doc_cfv(
+    session: Session,
+    document_id: uuid.UUID,
+    cf_names: Collection[str] | None = None,
+) -> list[models.CFV]:
+    if cf_names is not None and len(cf_names) == 0:
+        return []
+
+    stmt = select_doc_cfv(document_id, cf_names)
     result = []
     for row in session.execute(stmt):
         if row.cf_type == "date":
@@ -294,8 +476,16 @@ def get_document(session: Session, document_id: uuid.UUID) -> Document:
     return session.execute(stmt).scalars().one()
 
 
-def get_doc_ctx(session: Session, document_id: uuid.UUID) -> DocumentContext:
-    cf = get_doc_cfv(session, document_id)
+def get_doc_ctx(
+    session: Session,
+    document_id: uuid.UUID,
+    cf_names: Collection[str] | None = None,
+) -> DocumentContext:
+    """Returns document as seen by path template
+
+    With `cf_names` only these custom fields are included.
+    """
+    cf = get_doc_cfv(session, document_id, cf_names)
     custom_fields = [CField(name=i.name, value=i.value) for i in cf]
     doc = get_document(session, document_id)
 
@@ -401,6 +591,110 @@ def get_home(
     return home
 
 
+def _insert(session: Session) -> Callable[..., Insert]:
+    """Returns dialect specific `insert` (supports ON CONFLICT clauses)"""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+
+    return sqlite.insert
+
+
+def _folder_values(
+    title: str,
+    parent_id: uuid.UUID,
+    user_id: uuid.UUID | None,
+    group_id: uuid.UUID | None,
+) -> dict:
+    return dict(
+        id=uuid.uuid4(),
+        title=title,
+        parent_id=parent_id,
+        user_id=user_id,
+        group_id=group_id,
+        lang="en",
+        ctype=CTYPE_FOLDER,
+    )
+
+
+def upsert_folder(
+    session: Session,
+    title: str,
+    parent_id: uuid.UUID,
+    user_id: uuid.UUID | None = None,
+    group_id: uuid.UUID | None = None,
+) -> uuid.UUID:
+    """Returns ID of the folder `title` inside `parent_id`; creates it if missing
+
+    Lookup and creation is one INSERT ... ON CONFLICT statement on the
+    (parent_id, title, user_id) unique constraint, so concurrent workers
+    creating the same folder do not fail on the constraint: they all get
+    the ID of the same folder.
+
+    The constraint does not apply to nodes without user_id (i.e. group
+    owned nodes), as NULLs are not considered equal; group owned folders
+    are looked up first instead (see `_upsert_group_folder`).
+
+    Created folder is not committed; it is up to the caller.
+    """
+    if user_id is None:
+        return _upsert_group_folder(session, title, parent_id, group_id=group_id)
+
+    nodes = Node.__table__
+    values = _folder_values(title, parent_id, user_id=user_id, group_id=group_id)
+    stmt = _insert(session)(nodes).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[nodes.c.parent_id, nodes.c.title, nodes.c.user_id],
+        # no-op update, so that RETURNING yields ID of the existing node too
+        set_={"title": stmt.excluded.title},
+    ).returning(nodes.c.id, nodes.c.ctype)
+    row = session.execute(stmt).one()
+
+    if row.ctype != CTYPE_FOLDER:
+        raise ValueError(f"Node {title!r} in {parent_id} is not a folder")
+
+    if row.id == values["id"]:
+        session.execute(insert(Folder.__table__).values(node_id=row.id))
+        metrics.FOLDERS_CREATED.inc()
+
+    return row.id
+
+
+def _upsert_group_folder(
+    session: Session,
+    title: str,
+    parent_id: uuid.UUID,
+    group_id: uuid.UUID | None,
+) -> uuid.UUID:
+    """Same as `upsert_folder`, for folders without user_id
+
+    On PostgreSQL concurrent workers are serialized with a transaction
+    level advisory lock on (parent_id, title), thus only one of them
+    creates the folder. SQLite serializes writers anyway.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        key = func.hashtext(f"{parent_id}/{title}")
+        session.execute(select(func.pg_advisory_xact_lock(key)))
+
+    stmt = select(Node.id, Node.ctype).where(
+        Node.parent_id == parent_id,
+        Node.title == title,
+        Node.user_id.is_(None),
+        Node.group_id == group_id,
+    )
+    row = session.execute(stmt).first()
+    if row is not None:
+        if row.ctype != CTYPE_FOLDER:
+            raise ValueError(f"Node {title!r} in {parent_id} is not a folder")
+        return row.id
+
+    values = _folder_values(title, parent_id, user_id=None, group_id=group_id)
+    session.execute(insert(Node.__table__).values(**values))
+    session.execute(insert(Folder.__table__).values(node_id=values["id"]))
+    metrics.FOLDERS_CREATED.inc()
+
+    return values["id"]
+
+
 def mkdir_node(
     session: Session,
     path: PurePath,
@@ -411,34 +705,156 @@ def mkdir_node(
     if path in [PurePath("."), PurePath("/"), PurePath("home")]:
         return parent
 
-    if path.name in ["home", ".home"]:
+    if path.name in HOME_NAMES:
         return parent
 
-    folder = (
-        session.execute(
-            select(Folder).where(
-                Folder.parent_id == parent.id,
-                Folder.title == path.name,
+    folder_id = upsert_folder(
+        session, path.name, parent_id=parent.id, user_id=user_id, group_id=group_id
+    )
+
+    return session.get(Folder, folder_id)
+
+
+def path_segments(path: str) -> list[str]:
+    """Returns titles of the folders which lead to the target folder of `path`
+
+    Top-most folder comes first. Home folder is implicit, thus it is not
+    included. If path ends with "/" its last part is a folder as well.
+    """
+    stripped_path = path.strip()
+    if stripped_path.endswith("/"):
+        # Last part of the path is a folder, include it as parent
+        parents = [PurePath(stripped_path), *PurePath(stripped_path).parents]
+    else:
+        parents = PurePath(stripped_path).parents
+
+    return [node.name for node in reversed(parents) if node.name not in SKIP_NAMES]
+
+
+def select_path(
+    segments: list[str],
+    user_id: uuid.UUID | None = None,
+    group_id: uuid.UUID | None = None,
+    parent_id: uuid.UUID | None = None,
+) -> Select:
+    """Returns SqlAlchemy selector for existing folders along the path
+
+    Path is walked with a recursive CTE, starting from `parent_id` folder
+    or, if `parent_id` is not provided, from user's/group's home folder.
+    Selected rows are (id, level) of the starting folder (level 0) and of
+    every existing folder matching `segments`, ordered by level. If owner
+    has no home folder nothing is selected.
+    """
+    if parent_id is not None:
+        start = select(literal(parent_id, Uuid).label("id"))
+    elif group_id is not None:
+        start = select(Group.home_folder_id.label("id")).where(
+            Group.id == group_id, Group.home_folder_id.is_not(None)
+        )
+    else:
+        start = select(User.home_folder_id.label("id")).where(
+            User.id == user_id, User.home_folder_id.is_not(None)
+        )
+
+    walk = start.add_columns(literal_column("0", Integer).label("level")).cte(
+        "walk", recursive=True
+    )
+
+    if len(segments) > 0:
+        nodes = Node.__table__
+        level = walk.c.level + literal_column("1", Integer)
+        title = case(dict(enumerate(segments, start=1)), value=level)
+        walk = walk.union_all(
+            select(nodes.c.id, level)
+            .select_from(walk)
+            .join(
+                nodes,
+                (nodes.c.parent_id == walk.c.id)
+                & (nodes.c.title == title)
+                & (nodes.c.ctype == CTYPE_FOLDER),
             )
+            .where(walk.c.level < len(segments))
         )
-        .scalars()
-        .one_or_none()
+
+    return select(walk.c.id, walk.c.level).order_by(walk.c.level)
+
+
+def lookup_path(
+    session: Session,
+    segments: list[str],
+    user_id: uuid.UUID | None = None,
+    group_id: uuid.UUID | None = None,
+    parent_id: uuid.UUID | None = None,
+) -> Tuple[list[uuid.UUID], list[str]]:
+    """Resolves the whole path in one query
+
+    Returns IDs of the existing folders along the path (starting folder
+    first, deepest existing folder last) and titles of the missing ones.
+    """
+    stmt = select_path(
+        segments, user_id=user_id, group_id=group_id, parent_id=parent_id
     )
+    folder_ids = []
+    for row in session.execute(stmt):
+        # in case of duplicate titles take first folder of each level
+        if row.level == len(folder_ids):
+            folder_ids.append(row.id)
+
+    if len(folder_ids) == 0:
+        raise NoResultFound(f"Starting folder of path {segments} not found")
+
+    return folder_ids, segments[len(folder_ids) - 1 :]
+
+
+def _resolve_folder(
+    session: Session,
+    path: str,
+    user_id: uuid.UUID | None,
+    group_id: uuid.UUID | None,
+    resolver: FolderResolver,
+) -> FolderNode:
+    """Walks (and extends) resolver's trie along the `path`
+
+    Folders not yet known to the resolver are resolved with one
+    `lookup_path` query; the ones which do not exist are created.
+    Returns trie node of the target folder.
+    """
+    segments = path_segments(path)
+    node = resolver.home(user_id=user_id, group_id=group_id)
+    depth = 0
+    if node is not None:
+        while depth < len(segments) and node.child(segments[depth]) is not None:
+            node = node.child(segments[depth])
+            depth += 1
+
+    if node is not None and depth == len(segments):
+        return node
+
+    if node is None:
+        folder_ids, missing = lookup_path(
+            session, segments, user_id=user_id, group_id=group_id
+        )
+        node = resolver.add_home(folder_ids[0], user_id=user_id, group_id=group_id)
+    else:
+        folder_ids, missing = lookup_path(
+            session, segments[depth:], parent_id=node.folder_id
+        )
+
+    for folder_id in folder_ids[1:]:
+        node = node.add_child(segments[depth], folder_id)
+        depth += 1
 
-    if folder is None:
-        folder = Folder(
-            id=uuid.uuid4(),
-            title=path.name,
-            parent_id=parent.id,
+    for title in missing:
+        folder_id = upsert_folder(
+            session,
+            title,
+            parent_id=node.folder_id,
             user_id=user_id,
             group_id=group_id,
-            lang="en",
-            ctype=CTYPE_FOLDER,
         )
-        session.add(folder)
-        session.commit()
+        node = node.add_child(title, folder_id)
 
-    return folder
+    return node
 
 
 def mkdir(
@@ -446,6 +862,7 @@ def mkdir(
     path: str,
     user_id: uuid.UUID | None = None,
     group_id: uuid.UUID | None = None,
+    resolver: FolderResolver | None = None,
 ) -> Folder:
     """makes all node folders specified in path
 
@@ -463,29 +880,261 @@ def mkdir(
     of the user/group `uuid1`.
 
     If path is not absolute, it will be considered relative to user/group's home folder
+
+    Pass the same `resolver` to subsequent calls to skip DB lookups of
+    already resolved folders.
     """
+    if resolver is None:
+        resolver = FolderResolver()
 
-    parent = get_home(session, user_id=user_id, group_id=group_id)
+    with metrics.stage("mkdir"):
+        node = _resolve_folder(session, path, user_id, group_id, resolver)
 
-    stripped_path = path.strip()
-    if stripped_path.endswith("/"):
-        # Last part of the path is a folder, include it as parent
-        parents = [PurePath(stripped_path), *PurePath(stripped_path).parents]
-    else:
-        parents = PurePath(stripped_path).parents
+    return session.get(Folder, node.folder_id)
 
-    for node in reversed(parents):
-        parent = mkdir_node(
-            session, node, parent=parent, user_id=user_id, group_id=group_id
+
+def _select_existing_folders(
+    session: Session,
+    pairs: list[Tuple[uuid.UUID, str]],
+) -> dict[Tuple[uuid.UUID, str], uuid.UUID]:
+    """Returns IDs of already existing folders for (parent_id, title) pairs"""
+    result = {}
+    for batch in batched(pairs, MKDIR_LOOKUP_BATCH_SIZE):
+        wanted = set(batch)
+        stmt = select(Folder.id, Folder.parent_id, Folder.title).where(
+            Folder.parent_id.in_(list({parent_id for parent_id, _ in batch})),
+            Folder.title.in_(list({title for _, title in batch})),
         )
+        for row in session.execute(stmt):
+            key = (row.parent_id, row.title)
+            if key in wanted:
+                result[key] = row.id
+
+    return result
+
+
+def _insert_folders(
+    session: Session,
+    keys: list[Tuple[uuid.UUID, str]],
+    user_id: uuid.UUID | None = None,
+    group_id: uuid.UUID | None = None,
+) -> dict[Tuple[uuid.UUID, str], uuid.UUID]:
+    """Inserts folders for (parent_id, title) pairs with multi-row INSERTs
+
+    Folders which were meanwhile created by someone else are not inserted
+    (ON CONFLICT DO NOTHING), their IDs are looked up instead.
+    """
+    nodes = Node.__table__
+    result = {}
+
+    for batch in batched(keys, MKDIR_INSERT_BATCH_SIZE):
+        values = [
+            _folder_values(title, parent_id, user_id=user_id, group_id=group_id)
+            for parent_id, title in batch
+        ]
+        stmt = (
+            _insert(session)(nodes)
+            .values(values)
+            .on_conflict_do_nothing(
+                index_elements=[nodes.c.parent_id, nodes.c.title, nodes.c.user_id]
+            )
+            .returning(nodes.c.id, nodes.c.parent_id, nodes.c.title)
+        )
+        inserted = {(row.parent_id, row.title): row.id for row in session.execute(stmt)}
+        if len(inserted) > 0:
+            session.execute(
+                insert(Folder.__table__).values(
+                    [{"node_id": node_id} for node_id in inserted.values()]
+                )
+            )
+            metrics.FOLDERS_CREATED.inc(len(inserted))
+        result.update(inserted)
+
+    conflicted = [key for key in keys if key not in result]
+    if len(conflicted) > 0:
+        result.update(_select_existing_folders(session, conflicted))
+
+    for parent_id, title in keys:
+        if (parent_id, title) not in result:
+            raise ValueError(f"Node {title!r} in {parent_id} is not a folder")
+
+    return result
+
+
+def mkdir_many(
+    session: Session,
+    paths: Iterable[str],
+    user_id: uuid.UUID | None = None,
+    group_id: uuid.UUID | None = None,
+    resolver: FolderResolver | None = None,
+) -> dict[str, uuid.UUID]:
+    """Makes all node folders specified in `paths` (set based version of `mkdir`)
+
+    Folders are resolved one depth level at a time: for each level there
+    is at most one lookup query for folders not yet known to the `resolver`
+    and one multi-row insert of the missing ones. Created folders are not
+    committed; it is up to the caller.
+
+    Returns mapping of each path to the ID of its target folder.
+    """
+    if resolver is None:
+        resolver = FolderResolver()
+
+    nodes, _ = _resolve_many(session, paths, user_id, group_id, resolver, create=True)
+
+    return {path: node.folder_id for path, node in nodes.items()}
+
+
+def plan_mkdir_many(
+    session: Session,
+    paths: Iterable[str],
+    user_id: uuid.UUID | None = None,
+    group_id: uuid.UUID | None = None,
+    resolver: FolderResolver | None = None,
+) -> Tuple[dict[str, uuid.UUID | None], int]:
+    """Same as `mkdir_many`, but does not create anything
+
+    Returns mapping of each path to the ID of its target folder (None if
+    the folder does not exist yet) and number of folders which would be
+    created. Missing folders are remembered by the `resolver` (with None
+    ID), thus they are counted only once per run.
+    """
+    if resolver is None:
+        resolver = FolderResolver()
+
+    nodes, planned = _resolve_many(
+        session, paths, user_id, group_id, resolver, create=False
+    )
+
+    return {path: node.folder_id for path, node in nodes.items()}, planned
+
+
+def _resolve_many(
+    session: Session,
+    paths: Iterable[str],
+    user_id: uuid.UUID | None,
+    group_id: uuid.UUID | None,
+    resolver: FolderResolver,
+    create: bool,
+) -> Tuple[dict[str, FolderNode], int]:
+    """Returns trie node of the target folder of each path
+
+    Missing folders are inserted or, if not `create`, added to the trie
+    with None ID. Second item is the number of such missing folders.
+    """
+    home = resolver.home(user_id=user_id, group_id=group_id)
+    if home is None:
+        (home_id,), _ = lookup_path(session, [], user_id=user_id, group_id=group_id)
+        home = resolver.add_home(home_id, user_id=user_id, group_id=group_id)
+
+    segments = {path: path_segments(path) for path in set(paths)}
+    # trie node reached so far by each path
+    nodes = {path: home for path in segments}
+    # IDs of folders created during this call; they have no children yet
+    created_ids = set()
+    planned = 0
+    depth = 0
+    max_depth = max((len(items) for items in segments.values()), default=0)
+
+    while depth < max_depth:
+        missing: dict[Tuple[uuid.UUID, str], FolderNode] = {}
+        for path, items in segments.items():
+            if len(items) <= depth:
+                continue
+            node = nodes[path]
+            title = items[depth]
+            if node.child(title) is not None:
+                continue
+            if node.folder_id is None:
+                # parent does not exist (not created), thus neither does child
+                node.add_child(title, None)
+                planned += 1
+            else:
+                missing[(node.folder_id, title)] = node
+
+        lookup = [key for key in missing if key[0] not in created_ids]
+        for key, folder_id in _select_existing_folders(session, lookup).items():
+            missing.pop(key).add_child(key[1], folder_id)
+
+        if len(missing) > 0 and create:
+            folder_ids = _insert_folders(
+                session, list(missing), user_id=user_id, group_id=group_id
+            )
+            for key, node in missing.items():
+                node.add_child(key[1], folder_ids[key])
+            created_ids.update(folder_ids.values())
+        elif len(missing) > 0:
+            for key, node in missing.items():
+                node.add_child(key[1], None)
+            planned += len(missing)
+
+        for path, items in segments.items():
+            if len(items) > depth:
+                nodes[path] = nodes[path].child(items[depth])
+
+        depth += 1
+
+    return nodes, planned
+
+
+def select_folder_paths(folder_ids: list[uuid.UUID]) -> Select:
+    """Returns SqlAlchemy selector for titles of all ancestors of the folders
+
+    Selected rows are (folder_id, title, level) where level 0 is the folder
+    itself; rows of each folder are ordered from the top-most ancestor.
+    """
+    nodes = Node.__table__
+    parents = nodes.alias("parents")
+    walk = (
+        select(
+            nodes.c.id.label("folder_id"),
+            nodes.c.parent_id,
+            nodes.c.title,
+            literal_column("0", Integer).label("level"),
+        )
+        .where(nodes.c.id.in_(folder_ids))
+        .cte("ancestors", recursive=True)
+    )
+    walk = walk.union_all(
+        select(
+            walk.c.folder_id,
+            parents.c.parent_id,
+            parents.c.title,
+            walk.c.level + literal_column("1", Integer),
+        )
+        .select_from(walk)
+        .join(parents, parents.c.id == walk.c.parent_id)
+    )
+
+    return select(walk.c.folder_id, walk.c.title, walk.c.level).order_by(
+        walk.c.folder_id, walk.c.level.desc()
+    )
+
+
+def get_folder_paths(
+    session: Session, folder_ids: Iterable[uuid.UUID]
+) -> dict[uuid.UUID, str]:
+    """Returns absolute path (e.g. "/home/Receipts/") of each folder"""
+    titles: dict[uuid.UUID, list[str]] = {}
+    for batch in batched(set(folder_ids), MKDIR_LOOKUP_BATCH_SIZE):
+        for row in session.execute(select_folder_paths(list(batch))):
+            titles.setdefault(row.folder_id, []).append(row.title)
 
-    return parent
+    return {
+        folder_id: "/" + "".join(f"{title}/" for title in items)
+        for folder_id, items in titles.items()
+    }
 
 
 def mkdir_target(session: Session, document_id: uuid.UUID) -> Tuple[str, Folder]:
-    doc = get_doc_ctx(session, document_id)
-    path_template = get_path_template(session, document_id)
-    ev_path = get_evaluated_path(doc, path_template)
+    with metrics.stage("fetch_cfv"):
+        path_template = get_path_template(session, document_id)
+        # fetch only custom fields referenced by the template
+        compiled = template_cache.get_compiled_template(path_template)
+        doc = get_doc_ctx(session, document_id, cf_names=compiled.deps.cf_names)
+    with metrics.stage("evaluate"):
+        ev_path = template_cache.evaluate(compiled, doc)
+    metrics.DOCUMENTS_EVALUATED.inc()
     stmt = select(Document).where(Document.id == document_id)
     doc = session.execute(stmt).scalars().one()
     target_folder = mkdir(
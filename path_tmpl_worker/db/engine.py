@@ -1,9 +1,16 @@
 import logging
 import os
+from typing import TYPE_CHECKING
 
-from sqlalchemy import Engine, create_engine
+from sqlalchemy import Engine, create_engine, event
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from path_tmpl_worker import config, metrics
+
+if TYPE_CHECKING:
+    # needs greenlet; imported only when asyncio engine is used
+    from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("PAPERMERGE__DATABASE__URL")
 
@@ -15,12 +22,79 @@ connect_args = {}
 logger = logging.getLogger(__name__)
 
 
+def pool_options(url: str, settings: config.Settings) -> dict:
+    """Returns `create_engine` keyword arguments for connection pooling"""
+    if settings.papermerge__database__pool_size <= 0 or url.startswith("sqlite"):
+        return {"poolclass": NullPool}
+
+    return {
+        "poolclass": QueuePool,
+        "pool_size": settings.papermerge__database__pool_size,
+        "max_overflow": settings.papermerge__database__max_overflow,
+        "pool_pre_ping": settings.papermerge__database__pool_pre_ping,
+        "pool_recycle": settings.papermerge__database__pool_recycle,
+    }
+
+
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, poolclass=NullPool
+    SQLALCHEMY_DATABASE_URL,
+    connect_args=connect_args,
+    **pool_options(SQLALCHEMY_DATABASE_URL, config.get_settings()),
 )
+event.listen(engine, "before_cursor_execute", metrics.count_query)
 
 Session = sessionmaker(engine, expire_on_commit=False)
 
 
 def get_engine() -> Engine:
     return engine
+
+
+def async_url(url: str) -> str:
+    """Returns URL of the same database for the asyncio driver
+
+    `postgresql+psycopg` is used as is (psycopg provides both sync and
+    async connections); SQLite needs `aiosqlite`.
+    """
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+    return url
+
+
+_async_engine: "AsyncEngine | None" = None
+
+
+def get_async_engine() -> "AsyncEngine":
+    """Returns asyncio engine; it is created on first use"""
+    global _async_engine
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if _async_engine is None:
+        options = pool_options(SQLALCHEMY_DATABASE_URL, config.get_settings())
+        if options["poolclass"] is QueuePool:
+            options["poolclass"] = AsyncAdaptedQueuePool
+        _async_engine = create_async_engine(
+            async_url(SQLALCHEMY_DATABASE_URL), connect_args=connect_args, **options
+        )
+        event.listen(
+            _async_engine.sync_engine, "before_cursor_execute", metrics.count_query
+        )
+
+    return _async_engine
+
+
+def get_async_sessionmaker() -> "async_sessionmaker":
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    return async_sessionmaker(get_async_engine(), expire_on_commit=False)
+
+
+def reset_pool():
+    """Replaces connection pool inherited from the parent process
+
+    Connections opened before fork are shared with the parent, thus must
+    not be used (nor closed) by the child process; the child opens its own.
+    """
+    engine.dispose(close=False)
@@ -0,0 +1,78 @@
+import uuid
+
+
+class FolderNode:
+    """Trie node: resolved (or created) folder and its already known children
+
+    `folder_id` is None for folders which do not exist (see
+    `db.api.plan_mkdir_many`).
+    """
+
+    __slots__ = ("folder_id", "children")
+
+    def __init__(self, folder_id: uuid.UUID | None):
+        self.folder_id = folder_id
+        self.children: dict[str, "FolderNode"] = {}
+
+    def child(self, title: str) -> "FolderNode | None":
+        return self.children.get(title)
+
+    def add_child(self, title: str, folder_id: uuid.UUID | None) -> "FolderNode":
+        node = FolderNode(folder_id)
+        self.children[title] = node
+        return node
+
+
+class FolderResolver:
+    """Per-run cache of folder paths
+
+    Folders are kept in a trie keyed by owner (user or group) and then
+    by folder title i.e. path segment. Root of each owner's trie is the
+    owner's home folder. Once a folder was resolved (or created) it is
+    never looked up in DB again during the same run, thus DB work grows
+    with number of distinct folders, not with the number of documents.
+
+    Resolver is not aware of folders removed or renamed while the run is
+    in progress - create a new instance for each run.
+    """
+
+    def __init__(self):
+        self._homes: dict[tuple[str, uuid.UUID | None], FolderNode] = {}
+
+    @staticmethod
+    def _owner_key(
+        user_id: uuid.UUID | None, group_id: uuid.UUID | None
+    ) -> tuple[str, uuid.UUID | None]:
+        # same precedence as in `db.api.get_home`
+        if group_id is not None:
+            return ("group", group_id)
+
+        return ("user", user_id)
+
+    def home(
+        self,
+        user_id: uuid.UUID | None = None,
+        group_id: uuid.UUID | None = None,
+    ) -> FolderNode | None:
+        return self._homes.get(self._owner_key(user_id, group_id))
+
+    def add_home(
+        self,
+        folder_id: uuid.UUID,
+        user_id: uuid.UUID | None = None,
+        group_id: uuid.UUID | None = None,
+    ) -> FolderNode:
+        node = FolderNode(folder_id)
+        self._homes[self._owner_key(user_id, group_id)] = node
+        return node
+
+    def __len__(self) -> int:
+        """Number of cached folders (home folders included)"""
+        count = 0
+        stack = list(self._homes.values())
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children.values())
+
+        return count
@@ -0,0 +1,18 @@
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import GenericFunction
+
+
+class json_object_agg(GenericFunction):
+    """Aggregates (key, value) pairs into JSON object
+
+    Rendered as `json_object_agg` on PostgreSQL and as `json_group_object`
+    on SQLite.
+    """
+
+    name = "json_object_agg"
+    inherit_cache = True
+
+
+@compiles(json_object_agg, "sqlite")
+def _compile_json_group_object(element, compiler, **kw):
+    return f"json_group_object({compiler.process(element.clauses, **kw)})"
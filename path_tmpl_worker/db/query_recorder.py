@@ -0,0 +1,122 @@
+"""Opt-in recording of executed SQL statements
+
+    with record_queries(engine) as recorder:
+        api.move_document(db_session, document_id)
+
+    recorder.count  # number of statements
+    recorder.seconds  # total time spent in executing them
+    recorder.statements  # QueryStats per statement fingerprint
+
+Event listeners are installed on the engine on first use. Statements are
+recorded into the recorder of the current context (thread, task), thus
+concurrently running tasks do not mix their statements.
+"""
+
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from sqlalchemy import Engine, event
+
+_current: ContextVar["QueryRecorder | None"] = ContextVar(
+    "query_recorder", default=None
+)
+_installed: set[int] = set()
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|\$\d+|(?<!:):\w+")
+# (?, ?, ?), (?, ?, ?) ... -> (...)
+_GROUPS = re.compile(r"\((?:\?,\s*)*\?\)(?:,\s*\((?:\?,\s*)*\?\))*")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Returns statement with literals, parameters and value lists collapsed
+
+    Statements which differ only in values (e.g. number of rows of
+    a multi-row INSERT or of an IN list) get the same fingerprint.
+    """
+    result = _SPACES.sub(" ", statement).strip()
+    result = _LITERALS.sub("?", result)
+    result = _GROUPS.sub("(...)", result)
+
+    return result
+
+
+@dataclass(slots=True)
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class QueryRecorder:
+    count: int = 0
+    seconds: float = 0.0
+    statements: dict[str, QueryStats] = field(default_factory=dict)
+
+    def add(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        stats = self.statements.setdefault(fingerprint(statement), QueryStats())
+        stats.count += 1
+        stats.seconds += seconds
+
+    def report(self, limit: int = 10) -> str:
+        """Returns summary with the most frequent statements"""
+        lines = [f"{self.count} queries in {self.seconds * 1000:.1f} ms"]
+        items = sorted(
+            self.statements.items(), key=lambda item: item[1].count, reverse=True
+        )
+        for statement, stats in items[:limit]:
+            lines.append(
+                f"{stats.count:5} x {stats.seconds * 1000:8.1f} ms  {statement}"
+            )
+
+        return "\n".join(lines)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorder = _current.get()
+    started = conn.info.get("query_started")
+    if recorder is not None and started:
+        recorder.add(statement, time.perf_counter() - started.pop())
+
+
+def install(engine: Engine):
+    """Installs event listeners on the engine (once)"""
+    if id(engine) in _installed:
+        return
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    _installed.add(id(engine))
+
+
+def start(engine: Engine) -> tuple[QueryRecorder, object]:
+    """Starts recording in the current context; returns recorder and token"""
+    install(engine)
+    recorder = QueryRecorder()
+
+    return recorder, _current.set(recorder)
+
+
+def stop(token):
+    """Stops recording started with `start`"""
+    _current.reset(token)
+
+
+@contextmanager
+def record_queries(engine: Engine) -> Iterator[QueryRecorder]:
+    recorder, token = start(engine)
+    try:
+        yield recorder
+    finally:
+        stop(token)
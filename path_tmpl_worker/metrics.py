@@ -0,0 +1,222 @@
+"""Per-stage timings and counters in Prometheus text format
+
+Metrics are kept per process. With `papermerge__path_tmpl__metrics_port`
+set, worker serves them over HTTP (`/metrics`); prefork child processes
+serve theirs on consecutive ports (see `celery_app`).
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    items = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + items + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def collect(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {_format_value(self._value)}",
+        ]
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Histogram with one label (e.g. name of the stage)"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelname: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelname = labelname
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[str, _HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = _HistogramSeries(len(self.buckets) + 1)
+                self._series[label] = series
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, label: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label, time.perf_counter() - started)
+
+    def count(self, label: str) -> int:
+        series = self._series.get(label)
+        return series.count if series else 0
+
+    def collect(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for label in sorted(self._series):
+                series = self._series[label]
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                    cumulative += count
+                    labels = _format_labels(
+                        {self.labelname: label, "le": _format_value(bound)}
+                    )
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels({self.labelname: label})
+                lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+                lines.append(f"{self.name}_count{labels} {series.count}")
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+
+    def register(self, metric: Counter | Histogram) -> Counter | Histogram:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "path_tmpl_stage_seconds",
+        "Time spent in each stage of document moves",
+        labelname="stage",
+    )
+)
+TASK_SECONDS = REGISTRY.register(
+    Histogram("path_tmpl_task_seconds", "Duration of tasks", labelname="task")
+)
+DOCUMENTS_EVALUATED = REGISTRY.register(
+    Counter("path_tmpl_documents_evaluated_total", "Path templates evaluated")
+)
+FOLDERS_CREATED = REGISTRY.register(
+    Counter("path_tmpl_folders_created_total", "Folders created")
+)
+QUERIES = REGISTRY.register(
+    Counter("path_tmpl_queries_total", "SQL statements executed")
+)
+
+
+def stage(name: str):
+    """Times the enclosed block as stage `name`"""
+    return STAGE_SECONDS.time(name)
+
+
+def count_query(*args, **kwargs):
+    """SQLAlchemy `before_cursor_execute` listener"""
+    QUERIES.inc()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # do not log each scrape
+        pass
+
+
+def start_http_server(
+    port: int, addr: str = "0.0.0.0", registry: Registry = REGISTRY
+) -> ThreadingHTTPServer:
+    """Serves metrics from a daemon thread; port 0 picks a free port"""
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
@@ -103,6 +103,9 @@ class BulkUpdate(BaseModel):
     document_id: uuid.UUID
     ev_path: str
     title: str
+    # current parent; when known, documents which stay in the same folder
+    # with the same title are not updated
+    parent_id: uuid.UUID | None = None
 
 
 class DocumentMovedNotification(BaseModel):
@@ -115,13 +118,50 @@ class DocumentMovedNotification(BaseModel):
 
 
 class DocumentsMovedNotification(BaseModel):
+    # number of documents which changed folder and/or title
     count: int
+    # number of documents already at their evaluated path
+    unchanged_count: int = 0
     document_type_name: str
     document_type_id: uuid.UUID
     source_folder_ids: list[uuid.UUID]
     target_folder_ids: list[uuid.UUID]
 
 
+class FolderDocumentsMovedNotification(BaseModel):
+    # documents moved from the same source to the same target folder
+    source_folder_id: uuid.UUID
+    target_folder_id: uuid.UUID
+    document_ids: list[uuid.UUID]
+    count: int
+
+
+class MovePlan(BaseModel):
+    """Outcome of a bulk move, as planned without moving anything"""
+
+    document_type_id: uuid.UUID
+    document_type_name: str
+    # number of documents which would change folder and/or title
+    count: int = 0
+    # number of documents already at their evaluated path
+    unchanged_count: int = 0
+    # number of folders which would be created
+    folders_count: int = 0
+
+
+class MoveCheckpoint(BaseModel):
+    """Progress of an interrupted bulk move of documents of one type"""
+
+    # run which saved the checkpoint (e.g. Celery task ID)
+    run_id: str | None = None
+    # fingerprint of the path template the documents were moved with
+    template_fingerprint: str
+    # ID of the last document of the last committed chunk
+    last_document_id: uuid.UUID
+    count: int = 0
+    unchanged_count: int = 0
+
+
 class Event(BaseModel, Generic[T]):
     type: str
     payload: T
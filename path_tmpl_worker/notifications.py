@@ -0,0 +1,127 @@
+"""Batched publishing of notifications
+
+Events are buffered and published through one Redis pipeline (one round
+trip) when the buffer is full or when the oldest buffered event waited
+`max_delay` seconds, whichever comes first.
+"""
+
+import logging
+import threading
+from typing import Any
+
+import redis
+
+from path_tmpl_worker import metrics
+from path_tmpl_worker.constants import (
+    NOTIF_DOCUMENT_MOVED,
+    NOTIF_FOLDER_DOCUMENTS_MOVED,
+)
+from path_tmpl_worker.models import (
+    DocumentMovedNotification,
+    Event,
+    FolderDocumentsMovedNotification,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_moves(events: list[Event[Any]]) -> list[Event[Any]]:
+    """Replaces `document_moved` events with the same source and target
+    folder by one `folder_documents_moved` event
+
+    The collapsed event takes place of the first of the replaced events;
+    order of all other events is kept.
+    """
+    groups: dict[tuple, list[DocumentMovedNotification]] = {}
+    for event in events:
+        if event.type == NOTIF_DOCUMENT_MOVED:
+            key = (event.payload.source_folder_id, event.payload.target_folder_id)
+            groups.setdefault(key, []).append(event.payload)
+
+    result = []
+    for event in events:
+        if event.type != NOTIF_DOCUMENT_MOVED:
+            result.append(event)
+            continue
+
+        key = (event.payload.source_folder_id, event.payload.target_folder_id)
+        group = groups.pop(key, None)
+        if group is None:
+            # collapsed already
+            continue
+        if len(group) == 1:
+            result.append(event)
+            continue
+
+        payload = FolderDocumentsMovedNotification(
+            source_folder_id=key[0],
+            target_folder_id=key[1],
+            document_ids=[item.document_id for item in group],
+            count=len(group),
+        )
+        result.append(
+            Event[FolderDocumentsMovedNotification](
+                type=NOTIF_FOLDER_DOCUMENTS_MOVED, payload=payload
+            )
+        )
+
+    return result
+
+
+class NotificationPublisher:
+    def __init__(
+        self,
+        client: redis.Redis,
+        channel: str,
+        max_size: int = 100,
+        max_delay: float = 0.25,
+        collapse: bool = False,
+    ):
+        self.client = client
+        self.channel = channel
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.collapse = collapse
+        self._events: list[Event[Any]] = []
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    def publish(self, event: Event[Any]):
+        """Buffers the event; flushes the buffer if it is full"""
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= self.max_size or self.max_delay <= 0
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Publishes all buffered events"""
+        with self._lock:
+            events, self._events = self._events, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if len(events) == 0:
+            return
+
+        if self.collapse:
+            events = collapse_moves(events)
+
+        pipe = self.client.pipeline(transaction=False)
+        for event in events:
+            pipe.publish(self.channel, event.model_dump_json())
+        try:
+            with metrics.stage("publish"):
+                pipe.execute()
+        except redis.RedisError:
+            logger.exception(f"Failed to publish {len(events)} notifications")
+
+    def __len__(self) -> int:
+        """Number of buffered events"""
+        return len(self._events)
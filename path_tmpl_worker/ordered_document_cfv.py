@@ -3,12 +3,24 @@ from typing import Dict, Iterator
 
 from path_tmpl_worker.utils import str2date
 from path_tmpl_worker.models import (
+    CFValueType,
     DocumentCFV,
     DocumentCFVWithIndex,
     DocumentCFVRow,
 )
 
 
+def convert_cf_value(cf_type: str, cf_value: str | None) -> CFValueType:
+    """Converts custom field value as selected from DB (i.e. string)"""
+    if cf_type == "date":
+        return str2date(cf_value)
+
+    if cf_type == "monetary" and cf_value is not None:
+        return float(cf_value)
+
+    return cf_value
+
+
 class OrderedDocumentCFV:
 
     def __init__(self):
@@ -22,12 +34,7 @@ class OrderedDocumentCFV:
         result = {}
         i = 0
         for item in self.rows:
-            if item.cf_type == "date":
-                value = str2date(item.cf_value)
-            elif item.cf_type == "monetary" and item.cf_value is not None:
-                value = float(item.cf_value)
-            else:
-                value = item.cf_value
+            value = convert_cf_value(item.cf_type, item.cf_value)
 
             if item.doc_id in result:
                 result[item.doc_id].dcfv.custom_fields.append(
@@ -0,0 +1,71 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import batched
+from typing import Iterable, Iterator
+
+from path_tmpl_worker import template_cache
+from path_tmpl_worker.records import DocumentRecord, TemplateContext
+
+# compiled path template of the pool worker process
+_compiled: template_cache.CompiledTemplate | None = None
+
+
+def can_start_pool() -> bool:
+    """False in daemonic processes, e.g. children of Celery prefork pool"""
+    return not multiprocessing.current_process().daemon
+
+
+def _init_worker(path_template: str):
+    global _compiled
+    _compiled = template_cache.get_compiled_template(path_template)
+
+
+def _evaluate_batch(contexts: list[TemplateContext]) -> list[str]:
+    return [template_cache.evaluate(_compiled, ctx) for ctx in contexts]
+
+
+class ParallelEvaluator:
+    """Evaluates path template of many documents in a process pool
+
+    Documents are sent to pool workers in batches of `batch_size`; each
+    worker compiles the template once. While the pool evaluates, caller
+    keeps feeding (i.e. fetching) documents; at most two batches per worker
+    are in flight. Results are yielded in the same order as documents.
+
+    Note that Celery prefork pool processes are daemonic and thus cannot
+    start a process pool (see `can_start_pool`) - use it with `solo` or
+    `threads` Celery pool or from CLI.
+    """
+
+    def __init__(self, path_template: str, workers: int, batch_size: int):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(path_template,),
+        )
+
+    def __enter__(self) -> "ParallelEvaluator":
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.shutdown(cancel_futures=True)
+
+    def evaluate(
+        self, records: Iterable[DocumentRecord]
+    ) -> Iterator[tuple[DocumentRecord, str]]:
+        """Yields each document together with its evaluated path"""
+        in_flight: deque[tuple[tuple[DocumentRecord, ...], Future]] = deque()
+
+        for batch in batched(records, self.batch_size):
+            contexts = [TemplateContext.from_record(record) for record in batch]
+            in_flight.append((batch, self.pool.submit(_evaluate_batch, contexts)))
+            if len(in_flight) > 2 * self.workers:
+                done_batch, future = in_flight.popleft()
+                yield from zip(done_batch, future.result())
+
+        while in_flight:
+            done_batch, future = in_flight.popleft()
+            yield from zip(done_batch, future.result())
@@ -0,0 +1,85 @@
+"""Slotted records used internally on the bulk move path
+
+Unlike pydantic models in `path_tmpl_worker.models` they do not validate
+anything: values are expected to be already converted.
+"""
+
+import uuid
+from dataclasses import dataclass, field
+
+from pathtmpl import CField
+
+from path_tmpl_worker.models import CFNameType, CFValueType, CustomFieldType
+
+CustomFieldRecord = tuple[CFNameType, CFValueType, CustomFieldType | str]
+
+
+@dataclass(slots=True)
+class DocumentRecord:
+    """Same as `models.DocumentCFV`, without validation"""
+
+    id: uuid.UUID
+    title: str
+    parent_id: uuid.UUID
+    document_type_id: uuid.UUID | None
+    # sorted by custom field name
+    custom_fields: list[CustomFieldRecord]
+
+
+class CustomFieldValues(dict):
+    """Custom field values by name; missing custom fields are None"""
+
+    def __missing__(self, key):
+        return None
+
+
+@dataclass(slots=True)
+class TemplateContext:
+    """Document as seen by path template (i.e. `document` variable)
+
+    Mirrors attributes of `pathtmpl.DocumentContext`.
+    """
+
+    id: uuid.UUID
+    title: str
+    cf: CustomFieldValues = field(default_factory=CustomFieldValues)
+
+    @property
+    def has_all_cf(self) -> bool:
+        return len(self.cf) > 0 and all(value is not None for value in self.cf.values())
+
+    @property
+    def custom_fields(self) -> list[CField]:
+        # built on access, i.e. only for templates which use it
+        return [CField(name=name, value=value) for name, value in self.cf.items()]
+
+    @classmethod
+    def from_record(cls, record: DocumentRecord) -> "TemplateContext":
+        return cls(
+            id=record.id,
+            title=record.title,
+            cf=CustomFieldValues((cf[0], cf[1]) for cf in record.custom_fields),
+        )
+
+
+@dataclass(slots=True)
+class DocumentUpdate:
+    """Same as `models.BulkUpdate`, without validation"""
+
+    document_id: uuid.UUID
+    ev_path: str
+    # current title and parent of the document
+    title: str
+    parent_id: uuid.UUID | None = None
+
+
+@dataclass(slots=True)
+class PlannedMove:
+    """Document move as planned by `api.plan_move_documents`"""
+
+    document_id: uuid.UUID
+    # absolute paths, e.g. "/home/Receipts/bon.pdf"
+    old_path: str
+    new_path: str
+    # False if document is already at its evaluated path
+    moved: bool
@@ -1,15 +1,28 @@
+import time
 import uuid
+from functools import partial
 
 import jinja2
 import redis
 import logging
 
-from celery import shared_task
+from celery import chord, shared_task
+from celery.signals import (
+    task_postrun,
+    task_prerun,
+    worker_process_shutdown,
+    worker_shutdown,
+)
 
 from path_tmpl_worker.constants import NOTIF_DOCUMENT_MOVED, NOTIF_DOCUMENTS_MOVED
-from path_tmpl_worker.db.engine import Session
-from path_tmpl_worker import api
+from path_tmpl_worker.db import query_recorder
+from path_tmpl_worker.db.engine import Session, engine
+from path_tmpl_worker import api, db, metrics, template_cache
 from path_tmpl_worker import constants, config
+from path_tmpl_worker.bulk_registry import BulkMoveRegistry
+from path_tmpl_worker.checkpoint import RedisCheckpointStore
+from path_tmpl_worker.coalesce import COUNTERS_KEY, UNAFFECTED, Coalescer
+from path_tmpl_worker.notifications import NotificationPublisher
 from path_tmpl_worker.models import (
     Event,
     DocumentMovedNotification,
@@ -20,17 +33,80 @@ settings = config.get_settings()
 logger = logging.getLogger(__name__)
 CHANNEL = "notifications"
 redis_instance = redis.from_url(settings.papermerge__redis__url)
+checkpoints = RedisCheckpointStore(redis_instance)
+coalescer = Coalescer(
+    redis_instance, window=settings.papermerge__path_tmpl__coalesce_window
+)
+notifier = NotificationPublisher(
+    redis_instance,
+    CHANNEL,
+    max_size=settings.papermerge__path_tmpl__notify_batch_size,
+    max_delay=settings.papermerge__path_tmpl__notify_max_delay,
+    collapse=settings.papermerge__path_tmpl__notify_collapse,
+)
+bulk_moves = BulkMoveRegistry(redis_instance)
+# chunk of a bulk move which is not split
+WHOLE = (None, None)
+# task ID -> start time of tasks in progress
+_task_started: dict[str, float] = {}
+# task ID -> token of query recording of tasks in progress
+_task_queries: dict[str, object] = {}
 
 
 @shared_task(name=constants.PATH_TMPL_MOVE_DOCUMENT)
-def move_document(document_id: str):
+def move_document(
+    document_id: str,
+    deferred: bool = False,
+    changed_fields: list[str] | None = None,
+    title_changed: bool = False,
+):
+    """Move document
+
+    With coalescing enabled, the first request schedules a deferred move
+    and subsequent requests for the same document are merged into it
+    (see `coalesce.Coalescer`); with coalescing disabled, coalescer does not
+    touch Redis at all. Document is not moved at all if there
+    is a pending bulk move of its type which did not read it yet.
+
+    With `changed_fields` (names of changed custom fields) and/or
+    `title_changed`, request is dropped right away if path template does
+    not use any of them. This is checked before coalescing, so deferred
+    moves always evaluate the whole document.
+    """
+    if changed_fields is not None and not _affected(
+        document_id, changed_fields, title_changed
+    ):
+        redis_instance.hincrby(COUNTERS_KEY, UNAFFECTED, 1)
+        logger.debug(f"Move of {document_id} skipped: path template not affected")
+        return
+
+    if coalescer.enabled and not deferred:
+        if coalescer.claim(document_id):
+            move_document.apply_async(
+                (document_id,),
+                {"deferred": True},
+                countdown=coalescer.window,
+                queue=constants.PATH_TMPL_QUEUE,
+            )
+        return
+
+    if coalescer.enabled:
+        coalescer.start(document_id)
     try:
         with Session() as db_session:
-            message = api.move_document(db_session, uuid.UUID(document_id))
+            message = api.move_document(
+                db_session, uuid.UUID(document_id), superseded=bulk_moves.supersedes
+            )
+            if message is None:
+                logger.info(f"Move of {document_id} superseded by bulk move")
+                return
+
+            if coalescer.enabled:
+                coalescer.executed()
             ev = Event[DocumentMovedNotification](
                 type=NOTIF_DOCUMENT_MOVED, payload=message
             )
-            redis_instance.publish(CHANNEL, ev.model_dump_json())
+            notifier.publish(ev)
     except TypeError as ex:
         logger.error(
             f"Error while moving document: {ex}. Double check path template string"
@@ -39,19 +115,192 @@ def move_document(document_id: str):
         logger.error(f"Error while moving document: {ex}. Path template syntax error")
 
 
-@shared_task(name=constants.PATH_TMPL_MOVE_DOCUMENTS)
-def move_documents(document_type_id: str):
-    """Move docs in bulk"""
+def _affected(document_id: str, changed_fields: list[str], title_changed: bool):
     try:
         with Session() as db_session:
-            payload = api.move_documents(db_session, uuid.UUID(document_type_id))
-            ev = Event[DocumentsMovedNotification](
-                type=NOTIF_DOCUMENTS_MOVED, payload=payload
+            return api.affected_by(
+                db_session,
+                uuid.UUID(document_id),
+                changed_fields,
+                title_changed=title_changed,
             )
-            redis_instance.publish(CHANNEL, ev.model_dump_json())
+    except jinja2.exceptions.TemplateSyntaxError:
+        # reported by the move itself
+        return True
+
+
+# acknowledged only after completion: if worker dies mid-run, task is
+# redelivered and resumes from the checkpoint of the last committed chunk
+@shared_task(
+    name=constants.PATH_TMPL_MOVE_DOCUMENTS,
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+)
+def move_documents(self, document_type_id: str):
+    """Move docs in bulk
+
+    With `papermerge__path_tmpl__chunk_size` set, documents are split into
+    chunks moved by parallel `move_documents_chunk` subtasks and this task
+    only dispatches them.
+    """
+    chunk_size = settings.papermerge__path_tmpl__chunk_size
+    try:
+        with Session() as db_session:
+            if chunk_size > 0:
+                dtype = db.get_document_type(db_session, uuid.UUID(document_type_id))
+                # fail early (and once) on invalid template
+                template_cache.get_compiled_template(dtype.path_template)
+                bounds = db.get_chunk_bounds(db_session, dtype.id, chunk_size)
+                if len(bounds) > 1:
+                    bulk_moves.start(document_type_id, bounds)
+                    fan_out(document_type_id, bounds)
+                    return
+
+            try:
+                payload = api.move_documents(
+                    db_session,
+                    uuid.UUID(document_type_id),
+                    eval_workers=settings.papermerge__path_tmpl__eval_workers,
+                    eval_batch_size=settings.papermerge__path_tmpl__eval_batch_size,
+                    checkpoints=checkpoints,
+                    run_id=self.request.id,
+                    resume=_redelivered(self.request),
+                    on_page=partial(bulk_moves.advance, document_type_id, WHOLE),
+                )
+            except Exception:
+                # failed tasks are not redelivered, nothing is going to resume
+                checkpoints.delete(uuid.UUID(document_type_id))
+                raise
+            finally:
+                bulk_moves.finish(document_type_id, WHOLE)
+            publish_documents_moved(payload)
     except TypeError as ex:
         logger.error(
             f"Error while moving document: {ex}. Double check path template string"
         )
     except jinja2.exceptions.TemplateSyntaxError as ex:
         logger.error(f"Error while moving document: {ex}. Path template syntax error")
+
+
+def _redelivered(request) -> bool:
+    """True if task was redelivered, e.g. after its worker died mid-run"""
+    return bool((request.delivery_info or {}).get("redelivered"))
+
+
+def fan_out(
+    document_type_id: str,
+    bounds: list[tuple[uuid.UUID | None, uuid.UUID | None]],
+):
+    """Dispatches chunks as a chord; its callback sends one notification"""
+    header = [
+        move_documents_chunk.s(
+            document_type_id,
+            str(after_id) if after_id else None,
+            str(until_id) if until_id else None,
+        ).set(queue=constants.PATH_TMPL_QUEUE)
+        for after_id, until_id in bounds
+    ]
+    callback = move_documents_done.s().set(queue=constants.PATH_TMPL_QUEUE)
+    chord(header)(callback)
+    logger.info(f"Bulk move of type {document_type_id} split into {len(bounds)} chunks")
+
+
+@shared_task(
+    name=constants.PATH_TMPL_MOVE_DOCUMENTS_CHUNK,
+    acks_late=True,
+    ignore_result=False,
+)
+def move_documents_chunk(
+    document_type_id: str, after_id: str | None, until_id: str | None
+) -> dict | None:
+    """Move one chunk of documents; returns `DocumentsMovedNotification` as dict
+
+    Returns None if the chunk failed: an exception raised here would fail
+    the whole chord and `move_documents_done` would never run, so moves of
+    the other chunks would not be notified.
+    """
+    chunk = (
+        uuid.UUID(after_id) if after_id else None,
+        uuid.UUID(until_id) if until_id else None,
+    )
+    try:
+        with Session() as db_session:
+            payload = api.move_documents(
+                db_session,
+                uuid.UUID(document_type_id),
+                eval_workers=settings.papermerge__path_tmpl__eval_workers,
+                eval_batch_size=settings.papermerge__path_tmpl__eval_batch_size,
+                after_id=chunk[0],
+                until_id=chunk[1],
+                on_page=partial(bulk_moves.advance, document_type_id, chunk),
+            )
+            return payload.model_dump(mode="json")
+    except TypeError as ex:
+        logger.error(
+            f"Error while moving document: {ex}. Double check path template string"
+        )
+    except Exception:
+        logger.exception(
+            f"Chunk {after_id}..{until_id} of bulk move of type {document_type_id}"
+            " failed"
+        )
+    finally:
+        bulk_moves.finish(document_type_id, chunk)
+
+
+@shared_task(name=constants.PATH_TMPL_MOVE_DOCUMENTS_DONE)
+def move_documents_done(results: list[dict | None]):
+    """Sends one notification for all chunks of a bulk move
+
+    None results are failed chunks (see `move_documents_chunk`).
+    """
+    notifications = [
+        DocumentsMovedNotification.model_validate(item)
+        for item in results
+        if item is not None
+    ]
+    if len(notifications) > 0:
+        publish_documents_moved(api.merge_notifications(notifications))
+
+
+def publish_documents_moved(payload: DocumentsMovedNotification):
+    ev = Event[DocumentsMovedNotification](type=NOTIF_DOCUMENTS_MOVED, payload=payload)
+    notifier.publish(ev)
+    # bulk moves are rare and long; no point in waiting for more events
+    notifier.flush()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_notifications(*args, **kwargs):
+    notifier.flush()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, *args, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, *args, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.TASK_SECONDS.observe(task.name, time.perf_counter() - started)
+
+
+@task_prerun.connect
+def start_query_recording(task_id=None, *args, **kwargs):
+    if settings.papermerge__path_tmpl__record_queries:
+        _task_queries[task_id] = query_recorder.start(engine)
+
+
+@task_postrun.connect
+def stop_query_recording(task_id=None, task=None, *args, **kwargs):
+    item = _task_queries.pop(task_id, None)
+    if item is None:
+        return
+
+    recorder, token = item
+    query_recorder.stop(token)
+    logger.info(f"{task.name}[{task_id}]: {recorder.report()}")
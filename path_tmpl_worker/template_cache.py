@@ -0,0 +1,110 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import jinja2
+from pathtmpl import DocumentContext
+from pathtmpl.template import template_env
+
+from path_tmpl_worker.records import TemplateContext
+from path_tmpl_worker.template_deps import TemplateDeps, analyze
+
+# Maximum number of compiled path templates kept per worker process
+TEMPLATE_CACHE_SIZE = 128
+
+# sandboxed environment of `pathtmpl.get_evaluated_path`: same filters
+# (e.g. `datefmt`) and same restrictions on what templates may access
+env = template_env
+
+
+class CompiledTemplate(NamedTuple):
+    fingerprint: str
+    template: jinja2.Template
+    # what the template reads from `document` (see `template_deps`)
+    deps: TemplateDeps
+
+
+class TemplateCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def fingerprint(path_template: str) -> str:
+    """Returns hash of the path template text"""
+    if path_template is None:
+        raise TypeError("Path template is None")
+
+    return hashlib.sha256(path_template.encode("utf-8")).hexdigest()
+
+
+class TemplateCache:
+    """Bounded LRU of compiled path templates keyed by template fingerprint"""
+
+    def __init__(self, maxsize: int = TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[str, CompiledTemplate] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path_template: str) -> CompiledTemplate:
+        key = fingerprint(path_template)
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return compiled
+
+        # compile outside of the lock; syntax errors are raised and not cached
+        ast = env.parse(path_template)
+        compiled = CompiledTemplate(
+            fingerprint=key, template=env.from_string(ast), deps=analyze(ast)
+        )
+        with self._lock:
+            self.misses += 1
+            self._items[key] = compiled
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+        return compiled
+
+    def info(self) -> TemplateCacheInfo:
+        with self._lock:
+            return TemplateCacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                maxsize=self.maxsize,
+                currsize=len(self._items),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_cache = TemplateCache()
+
+
+def get_compiled_template(path_template: str) -> CompiledTemplate:
+    """Returns compiled path template from process wide cache"""
+    return _cache.get(path_template)
+
+
+def cache_info() -> TemplateCacheInfo:
+    return _cache.info()
+
+
+def cache_clear():
+    _cache.clear()
+
+
+def evaluate(compiled: CompiledTemplate, ctx: DocumentContext | TemplateContext) -> str:
+    """Evaluates (renders) already compiled path template for given document"""
+    return compiled.template.render(document=ctx)
@@ -0,0 +1,88 @@
+"""Static analysis of what a path template reads from `document`
+
+    deps = analyze(env.parse("/home/{{ document.cf['Shop'] }}/"))
+    deps.cf_names  # frozenset({"Shop"})
+
+Analysis is conservative: whenever template uses `document` (or
+`document.cf`) in a way which cannot be followed statically - e.g.
+`document.cf[name]` with a variable `name`, `document.has_all_cf` or
+`{% set doc = document %}` - `cf_names` is None, meaning that all custom
+fields are needed.
+"""
+
+from typing import Iterator, NamedTuple
+
+from jinja2 import nodes
+
+DOCUMENT = "document"
+# dict methods which may be called on `document.cf`; custom fields with
+# these names cannot be told apart from the methods
+_CF_METHODS = frozenset({"get", "items", "keys", "values"})
+
+
+class TemplateDeps(NamedTuple):
+    # names of referenced custom fields; None = all custom fields
+    cf_names: frozenset[str] | None
+    title: bool
+    id: bool
+
+
+ALL = TemplateDeps(cf_names=None, title=True, id=True)
+
+
+def _walk(node: nodes.Node, parent: nodes.Node | None = None) -> Iterator[tuple]:
+    """Yields (node, parent) pairs of the whole tree"""
+    yield node, parent
+    for child in node.iter_child_nodes():
+        yield from _walk(child, node)
+
+
+def _const_str(node: nodes.Node) -> str | None:
+    if isinstance(node, nodes.Const) and isinstance(node.value, str):
+        return node.value
+
+    return None
+
+
+def analyze(ast: nodes.Template) -> TemplateDeps:
+    """Returns which attributes of `document` the parsed template references"""
+    parents = {}
+    names = []
+    for node, parent in _walk(ast):
+        parents[id(node)] = parent
+        if isinstance(node, nodes.Name) and node.name == DOCUMENT:
+            if node.ctx != "load":
+                # `document` is redefined, e.g. {% for document in ... %}
+                return ALL
+            names.append(node)
+
+    cf_names = set()
+    title = False
+    id_ = False
+    for name in names:
+        parent = parents[id(name)]
+        if not isinstance(parent, nodes.Getattr) or parent.node is not name:
+            # `document` is passed as a whole
+            return ALL
+        if parent.attr == "title":
+            title = True
+            continue
+        if parent.attr == "id":
+            id_ = True
+            continue
+        if parent.attr != "cf":
+            return ALL
+
+        grandparent = parents[id(parent)]
+        if isinstance(grandparent, nodes.Getitem) and grandparent.node is parent:
+            key = _const_str(grandparent.arg)
+        elif isinstance(grandparent, nodes.Getattr) and grandparent.node is parent:
+            # `document.cf.Shop` falls back to item lookup
+            key = None if grandparent.attr in _CF_METHODS else grandparent.attr
+        else:
+            key = None
+        if key is None:
+            return ALL
+        cf_names.add(key)
+
+    return TemplateDeps(cf_names=frozenset(cf_names), title=title, id=id_)
@@ -1,10 +1,17 @@
+import os
 import uuid
+from contextlib import contextmanager
+
 import pytest
 
+# Redis client of `tasks` is created on import (it connects lazily); tests
+# replace it with `FakeRedis`
+os.environ.setdefault("PAPERMERGE__REDIS__URL", "redis://localhost:6379/0")
 
-from path_tmpl_worker.db import Base
+from path_tmpl_worker.db import Base  # noqa: E402
 from path_tmpl_worker.db.engine import engine, Session
 from path_tmpl_worker.db import orm
+from path_tmpl_worker.db.query_recorder import record_queries
 from path_tmpl_worker import models, constants
 from path_tmpl_worker.config import get_settings
 
@@ -20,6 +27,20 @@ def db_session():
     Base.metadata.drop_all(engine, checkfirst=False)
 
 
+@pytest.fixture
+def query_budget():
+    """Asserts that enclosed block executes at most `max_queries` statements"""
+
+    @contextmanager
+    def _budget(max_queries: int):
+        with record_queries(engine) as recorder:
+            yield recorder
+
+        assert recorder.count <= max_queries, recorder.report()
+
+    return _budget
+
+
 @pytest.fixture
 def make_custom_field(db_session: Session):
     def _make_custom_field(name: str, type: models.CustomFieldType):
@@ -161,3 +182,29 @@ def make_user(db_session: Session):
 @pytest.fixture()
 def user(make_user) -> orm.User:
     return make_user(username="random")
+
+
+@pytest.fixture()
+def make_group(db_session: Session):
+    def _maker(name: str):
+        group_id = uuid.uuid4()
+        home_id = uuid.uuid4()
+
+        db_group = orm.Group(id=group_id, name=name)
+        db_session.add(db_group)
+        db_session.commit()
+        db_home = orm.Folder(
+            id=home_id,
+            title=constants.HOME_TITLE,
+            ctype=constants.CTYPE_FOLDER,
+            lang="de",
+            group_id=group_id,
+        )
+        db_session.add(db_home)
+        db_session.commit()
+        db_group.home_folder_id = db_home.id
+        db_session.commit()
+
+        return db_group
+
+    return _maker
@@ -0,0 +1,95 @@
+import asyncio
+import uuid
+
+import pytest
+
+from path_tmpl_worker.db.engine import SQLALCHEMY_DATABASE_URL, async_url
+
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa
+from sqlalchemy.pool import NullPool  # noqa
+
+from path_tmpl_worker import aio  # noqa
+from .utils import get_ancestors  # noqa
+
+
+def _run(coro_func):
+    async def main():
+        engine = create_async_engine(
+            async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool
+        )
+        try:
+            return await coro_func(async_sessionmaker(engine, expire_on_commit=False))
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+def test_move_document(db_session, make_receipt):
+    doc = make_receipt(title="bon.pdf", path_template="/home/Receipts/")
+
+    async def move(sessionmaker):
+        async with sessionmaker() as session:
+            return await aio.move_document(session, doc.id)
+
+    message = _run(move)
+
+    assert message.document_id == doc.id
+    breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+    assert "/" + breadcrumb == "/home/Receipts/bon.pdf"
+
+
+def test_move_document_skips_changes_not_used_by_template(db_session, make_receipt):
+    doc = make_receipt(title="bon.pdf", path_template="/home/Receipts/")
+
+    async def move(sessionmaker):
+        async with sessionmaker() as session:
+            return await aio.move_document(session, doc.id, changed_fields=["Shop"])
+
+    assert _run(move) is None
+
+
+def test_runner_moves_documents_concurrently(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    template = "/home/Receipts/{{ document.title }}/"
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template=template
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}", dtype=dtype, user=user) for i in range(6)
+    ]
+    moved = []
+
+    async def run(sessionmaker):
+        runner = aio.AsyncRunner(sessionmaker, concurrency=3, on_moved=moved.append)
+        await runner.run([doc.id for doc in docs])
+        return runner
+
+    runner = _run(run)
+
+    assert runner.moved == 6
+    assert runner.failed == 0
+    assert {message.document_id for message in moved} == {doc.id for doc in docs}
+    db_session.expire_all()
+    for doc in docs:
+        breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+        assert "/" + breadcrumb == f"/home/Receipts/{doc.title}/{doc.title}"
+
+
+def test_runner_counts_failed_moves(db_session, make_receipt):
+    doc = make_receipt(title="bon.pdf", path_template="/home/Receipts/")
+
+    async def run(sessionmaker):
+        runner = aio.AsyncRunner(sessionmaker, concurrency=2)
+        # second document does not exist
+        await runner.run([doc.id, uuid.uuid4()])
+        return runner
+
+    runner = _run(run)
+
+    assert runner.moved == 1
+    assert runner.failed == 1
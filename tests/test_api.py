@@ -1,6 +1,13 @@
-from sqlalchemy import select
+import tracemalloc
+import uuid
 
-from path_tmpl_worker import api
+import pytest
+from sqlalchemy import insert, select
+
+from path_tmpl_worker import api, template_cache
+from path_tmpl_worker.checkpoint import MemoryCheckpointStore
+from path_tmpl_worker.models import MoveCheckpoint
+from path_tmpl_worker.template_cache import fingerprint
 from path_tmpl_worker.db import orm
 from path_tmpl_worker.db import api as dbapi
 from .utils import get_ancestors
@@ -68,6 +75,37 @@ def test_move_documents_with_one_doc_with_cfv(db_session, make_receipt):
     assert actual_breadcrumb == f"/home/Receipts/rewe-2024-11-18-{doc.id}.pdf"
 
 
+def test_single_and_bulk_move_evaluate_custom_fields_alike(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    template = """
+    /home/{% for cf in document.custom_fields %}{{ cf.name }}-{{ cf.value }}/{% endfor %}
+    """
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template=template
+    )
+    custom_fields = {"Total": 10.99, "Shop": "rewe", "EffectiveDate": "2024-11-18"}
+    single = make_receipt(title="single.pdf", dtype=dtype, user=user)
+    bulk = make_receipt(title="bulk.pdf", dtype=dtype, user=user)
+    for doc in (single, bulk):
+        dbapi.update_doc_cfv(
+            db_session, document_id=doc.id, custom_fields=custom_fields
+        )
+
+    api.move_document(db_session, single.id)
+    api.move_documents(db_session, document_type_id=dtype.id)
+
+    single_path = [a[1] for a in get_ancestors(db_session, single.id)][:-1]
+    bulk_path = [a[1] for a in get_ancestors(db_session, bulk.id)][:-1]
+    assert single_path == bulk_path
+    assert single_path == [
+        "home",
+        "EffectiveDate-2024-11-18",
+        "Shop-rewe",
+        "Total-10.99",
+    ]
+
+
 def test_move_documents_with_two_docs_with_cfv(
     db_session, make_receipt, make_document_type_groceries, user
 ):
@@ -108,3 +146,423 @@ def test_move_documents_with_two_docs_with_cfv(
     assert actual_breadcrumb1 == f"/home/Receipts/rewe-2024-11-18-{doc1.id}.pdf"
     assert refreshed_doc2.title == f"lidl-2024-01-13-{doc2.id}.pdf"
     assert actual_breadcrumb2 == f"/home/Receipts/lidl-2024-01-13-{doc2.id}.pdf"
+
+
+def test_move_documents_multiple_pages(
+    db_session, monkeypatch, make_receipt, make_document_type_groceries, user
+):
+    monkeypatch.setattr(api, "PAGE_SIZE", 2)
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(5)
+    ]
+
+    result = api.move_documents(db_session, document_type_id=dtype.id)
+
+    assert result.count == 5
+    for doc in docs:
+        breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+        assert "/" + breadcrumb == f"/home/Receipts/{doc.title}"
+
+
+def test_move_documents_skips_documents_already_in_place(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(3)
+    ]
+
+    first = api.move_documents(db_session, document_type_id=dtype.id)
+    assert first.count == 3
+    assert first.unchanged_count == 0
+
+    # user moves one document back home
+    home_id = user.home_folder_id
+    db_session.refresh(docs[0])
+    receipts_id = docs[0].parent_id
+    docs[0].parent_id = home_id
+    db_session.commit()
+
+    second = api.move_documents(db_session, document_type_id=dtype.id)
+
+    assert second.count == 1
+    assert second.unchanged_count == 2
+    assert second.source_folder_ids == [home_id]
+    assert second.target_folder_ids == [receipts_id]
+
+    third = api.move_documents(db_session, document_type_id=dtype.id)
+
+    assert third.count == 0
+    assert third.unchanged_count == 3
+    assert third.source_folder_ids == []
+    assert third.target_folder_ids == []
+
+
+def test_move_documents_resumes_from_checkpoint(
+    db_session, monkeypatch, make_receipt, make_document_type_groceries, user
+):
+    monkeypatch.setattr(api, "PAGE_SIZE", 2)
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(5)
+    ]
+    first_chunk = sorted(doc.id for doc in docs)[:2]
+    checkpoints = MemoryCheckpointStore()
+    apply_updates = api.apply_updates
+    calls = []
+
+    def crash_on_second_chunk(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("worker lost")
+        return apply_updates(*args, **kwargs)
+
+    monkeypatch.setattr(api, "apply_updates", crash_on_second_chunk)
+    with pytest.raises(RuntimeError):
+        api.move_documents(
+            db_session, document_type_id=dtype.id, checkpoints=checkpoints
+        )
+    db_session.rollback()
+
+    checkpoint = checkpoints.get(dtype.id)
+    assert checkpoint.last_document_id == first_chunk[-1]
+    assert checkpoint.count == 2
+
+    resumed = []
+
+    def record_resumed(db_session, updates, **kwargs):
+        resumed.extend(item.document_id for item in updates)
+        return apply_updates(db_session, updates, **kwargs)
+
+    monkeypatch.setattr(api, "apply_updates", record_resumed)
+    result = api.move_documents(
+        db_session, document_type_id=dtype.id, checkpoints=checkpoints
+    )
+
+    assert result.count == 5
+    # first chunk was committed before the crash and is not processed again
+    assert sorted(resumed) == sorted(doc.id for doc in docs)[2:]
+    assert checkpoints.get(dtype.id) is None
+    for doc in docs:
+        breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+        assert "/" + breadcrumb == f"/home/Receipts/{doc.title}"
+
+
+def test_move_documents_ignores_checkpoint_of_other_template(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(3)
+    ]
+    checkpoints = MemoryCheckpointStore()
+    checkpoints.save(
+        dtype.id,
+        MoveCheckpoint(
+            template_fingerprint=fingerprint("/home/Invoices/"),
+            last_document_id=max(doc.id for doc in docs),
+            count=3,
+        ),
+    )
+
+    result = api.move_documents(
+        db_session, document_type_id=dtype.id, checkpoints=checkpoints
+    )
+
+    assert result.count == 3
+    assert checkpoints.get(dtype.id) is None
+
+
+@pytest.mark.parametrize(
+    "run_id, resume", [("new-task", True), ("old-task", False), (None, True)]
+)
+def test_fresh_run_does_not_resume_from_stale_checkpoint(
+    db_session, make_receipt, make_document_type_groceries, user, run_id, resume
+):
+    template = "/home/Receipts/"
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template=template
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(3)
+    ]
+    # left behind by a run which failed and was not retried
+    checkpoints = MemoryCheckpointStore()
+    checkpoints.save(
+        dtype.id,
+        MoveCheckpoint(
+            run_id="old-task",
+            template_fingerprint=fingerprint(template),
+            last_document_id=max(doc.id for doc in docs),
+            count=3,
+        ),
+    )
+
+    result = api.move_documents(
+        db_session,
+        document_type_id=dtype.id,
+        checkpoints=checkpoints,
+        run_id=run_id,
+        resume=resume,
+    )
+
+    assert result.count == 3
+    assert checkpoints.get(dtype.id) is None
+
+
+def test_move_documents_in_chunks(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    template = "/home/Receipts/{{ document.title }}"
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template=template
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(7)
+    ]
+
+    result = api.merge_notifications(
+        api.move_documents(
+            db_session, document_type_id=dtype.id, after_id=after_id, until_id=until_id
+        )
+        for after_id, until_id in dbapi.get_chunk_bounds(
+            db_session, dtype.id, chunk_size=3
+        )
+    )
+
+    assert result.count == 7
+    assert result.unchanged_count == 0
+    assert result.source_folder_ids == [user.home_folder_id]
+    assert len(result.target_folder_ids) == 1
+    for doc in docs:
+        breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+        assert "/" + breadcrumb == f"/home/Receipts/{doc.title}"
+
+
+def test_move_document_superseded(db_session, make_receipt):
+    doc = make_receipt(title="bon.pdf", path_template="/home/Receipts/")
+    calls = []
+
+    def superseded(document_type_id, document_id):
+        calls.append((document_type_id, document_id))
+        return True
+
+    result = api.move_document(db_session, doc.id, superseded=superseded)
+
+    assert result is None
+    assert calls == [(doc.document_type_id, doc.id)]
+    refreshed_doc = db_session.get(orm.Document, doc.id)
+    assert refreshed_doc.parent_id == doc.parent_id
+
+
+def test_move_documents_reports_pages_before_reading_them(
+    db_session, monkeypatch, make_receipt, make_document_type_groceries, user
+):
+    monkeypatch.setattr(api, "PAGE_SIZE", 2)
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    doc_ids = sorted(
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user).id
+        for i in range(5)
+    )
+    pages = []
+
+    api.move_documents(db_session, document_type_id=dtype.id, on_page=pages.append)
+
+    assert pages == [doc_ids[1], doc_ids[3], None]
+
+
+def test_move_documents_memory_does_not_grow_with_number_of_documents(
+    db_session, monkeypatch, make_document_type_groceries, user
+):
+    monkeypatch.setattr(api, "PAGE_SIZE", 50)
+    template = "/home/Receipts/{{ document.id }}.pdf"
+    small = make_document_type_groceries(
+        title="Small", user_id=user.id, path_template=template
+    )
+    large = make_document_type_groceries(
+        title="Large", user_id=user.id, path_template=template
+    )
+    _make_receipts(db_session, dtype=small, user=user, count=50)
+    _make_receipts(db_session, dtype=large, user=user, count=1000)
+    # warm up statement and template caches with both types, then move
+    # all documents again (to another folder) with warm caches only
+    api.move_documents(db_session, document_type_id=small.id)
+    api.move_documents(db_session, document_type_id=large.id)
+    template = "/home/Archive/{{ document.id }}.pdf"
+    small.path_template = template
+    large.path_template = template
+    db_session.commit()
+    template_cache.get_compiled_template(template)
+
+    small_peak = _peak_memory(api.move_documents, db_session, small.id)
+    large_peak = _peak_memory(api.move_documents, db_session, large.id)
+
+    assert large_peak < 2 * small_peak
+
+
+def test_move_document_skips_changes_not_used_by_template(
+    db_session, make_receipt, query_budget
+):
+    template = "/home/Receipts/{{ document.cf['Shop'] }}/"
+    doc = make_receipt(title="bon.pdf", path_template=template)
+
+    # only the path template is read
+    with query_budget(1):
+        result = api.move_document(
+            db_session, doc.id, changed_fields=["Total"], title_changed=True
+        )
+
+    assert result is None
+    breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+    assert "/" + breadcrumb == "/home/bon.pdf"
+
+
+@pytest.mark.parametrize(
+    "template, changed_fields, title_changed",
+    [
+        ("/home/Receipts/{{ document.cf['Shop'] }}/", ["Total", "Shop"], False),
+        ("/home/Receipts/{{ document.title }}", [], True),
+        # cannot be analyzed
+        ("/home/Receipts/{% if document.has_all_cf %}all/{% endif %}", [], False),
+    ],
+)
+def test_move_document_with_changes_used_by_template(
+    db_session, make_receipt, template, changed_fields, title_changed
+):
+    doc = make_receipt(title="bon.pdf", path_template=template)
+
+    result = api.move_document(
+        db_session,
+        doc.id,
+        changed_fields=changed_fields,
+        title_changed=title_changed,
+    )
+
+    assert result is not None
+    assert result.document_id == doc.id
+
+
+def test_plan_move_documents(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(3)
+    ]
+    # already in place
+    api.move_document(db_session, docs[0].id)
+    folders_before = db_session.execute(select(orm.Folder.id)).scalars().all()
+    moves = []
+
+    plan = api.plan_move_documents(
+        db_session, document_type_id=dtype.id, on_move=moves.append
+    )
+
+    assert plan.count == 2
+    assert plan.unchanged_count == 1
+    # "Receipts" exists already
+    assert plan.folders_count == 0
+    assert {(m.document_id, m.old_path, m.new_path, m.moved) for m in moves} == {
+        (
+            docs[0].id,
+            "/home/Receipts/receipt-0.pdf",
+            "/home/Receipts/receipt-0.pdf",
+            False,
+        ),
+        (docs[1].id, "/home/receipt-1.pdf", "/home/Receipts/receipt-1.pdf", True),
+        (docs[2].id, "/home/receipt-2.pdf", "/home/Receipts/receipt-2.pdf", True),
+    }
+    # nothing was written
+    assert db_session.execute(select(orm.Folder.id)).scalars().all() == folders_before
+    for doc in docs[1:]:
+        breadcrumb = "/".join([a[1] for a in get_ancestors(db_session, doc.id)])
+        assert "/" + breadcrumb == f"/home/{doc.title}"
+
+
+def test_plan_move_documents_counts_missing_folders(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    template = "/home/Receipts/{{ document.id }}/"
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template=template
+    )
+    for i in range(3):
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user)
+
+    plan = api.plan_move_documents(db_session, document_type_id=dtype.id)
+
+    # "Receipts" and one folder per document
+    assert plan.folders_count == 4
+    assert plan.count == 3
+
+
+def test_move_document_query_budget(db_session, make_receipt, query_budget):
+    doc = make_receipt(title="bon.pdf", path_template="/home/My Documents/Receipts/")
+
+    # 11 statements on SQLite and PostgreSQL
+    with query_budget(12):
+        api.move_document(db_session, document_id=doc.id)
+
+
+def test_move_documents_queries_do_not_grow_with_number_of_documents(
+    db_session, make_document_type_groceries, user, query_budget
+):
+    template = "/home/Receipts/{{ document.id }}.pdf"
+    small = make_document_type_groceries(
+        title="Small", user_id=user.id, path_template=template
+    )
+    large = make_document_type_groceries(
+        title="Large", user_id=user.id, path_template=template
+    )
+    _make_receipts(db_session, dtype=small, user=user, count=10)
+    _make_receipts(db_session, dtype=large, user=user, count=100)
+
+    # first run also creates the "Receipts" folder
+    with query_budget(10) as small_queries:
+        api.move_documents(db_session, document_type_id=small.id)
+    with query_budget(small_queries.count):
+        api.move_documents(db_session, document_type_id=large.id)
+
+
+def _make_receipts(db_session, dtype, user, count: int):
+    db_session.execute(
+        insert(orm.Document),
+        [
+            dict(
+                id=uuid.uuid4(),
+                ctype="document",
+                # titles are unique per parent folder and owner
+                title=f"receipt-{dtype.name}-{i}.pdf",
+                document_type_id=dtype.id,
+                user_id=user.id,
+                lang="de",
+                parent_id=user.home_folder_id,
+            )
+            for i in range(count)
+        ],
+    )
+    db_session.commit()
+
+
+def _peak_memory(func, *args) -> int:
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
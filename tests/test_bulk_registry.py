@@ -0,0 +1,48 @@
+import uuid
+
+from path_tmpl_worker.bulk_registry import BulkMoveRegistry
+from path_tmpl_worker.coalesce import COUNTERS_KEY, SUPERSEDED
+from .utils import FakeRedis
+
+
+def test_single_moves_superseded_until_bulk_move_reads_document():
+    client = FakeRedis()
+    registry = BulkMoveRegistry(client)
+    type_id = uuid.uuid4()
+    doc_ids = sorted(uuid.uuid4() for _ in range(6))
+    chunks = [(None, doc_ids[2]), (doc_ids[2], None)]
+
+    assert registry.supersedes(type_id, doc_ids[0]) is False
+
+    registry.start(type_id, chunks)
+
+    assert registry.pending_since(type_id) is not None
+    assert all(registry.supersedes(type_id, doc_id) for doc_id in doc_ids)
+
+    # first chunk reads its first page
+    registry.advance(type_id, chunks[0], doc_ids[1])
+
+    assert registry.supersedes(type_id, doc_ids[0]) is False
+    assert registry.supersedes(type_id, doc_ids[1]) is False
+    assert registry.supersedes(type_id, doc_ids[2]) is True
+    assert registry.supersedes(type_id, doc_ids[3]) is True
+
+    # second chunk reads its last page
+    registry.advance(type_id, chunks[1], None)
+
+    assert registry.supersedes(type_id, doc_ids[5]) is False
+
+    registry.finish(type_id, chunks[0])
+    registry.finish(type_id, chunks[1])
+
+    assert registry.pending_since(type_id) is None
+    assert registry.supersedes(type_id, doc_ids[2]) is False
+    assert client.hget(COUNTERS_KEY, SUPERSEDED) == 8
+
+
+def test_other_types_are_not_superseded():
+    registry = BulkMoveRegistry(FakeRedis())
+    registry.start(uuid.uuid4(), [(None, None)])
+
+    assert registry.supersedes(uuid.uuid4(), uuid.uuid4()) is False
+    assert registry.supersedes(None, uuid.uuid4()) is False
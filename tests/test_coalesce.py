@@ -0,0 +1,47 @@
+import uuid
+
+from path_tmpl_worker.coalesce import (
+    COALESCED,
+    EXECUTED,
+    SUPERSEDED,
+    UNAFFECTED,
+    Coalescer,
+)
+from .utils import FakeRedis
+
+
+def test_requests_are_merged_into_pending_move():
+    coalescer = Coalescer(FakeRedis(), window=0.5)
+    doc_id = uuid.uuid4()
+    other_doc_id = uuid.uuid4()
+
+    assert coalescer.claim(doc_id) is True
+    assert coalescer.claim(doc_id) is False
+    assert coalescer.claim(doc_id) is False
+    # other documents are not affected
+    assert coalescer.claim(other_doc_id) is True
+
+    coalescer.start(doc_id)
+    coalescer.executed()
+
+    assert coalescer.counters() == {
+        COALESCED: 2,
+        EXECUTED: 1,
+        SUPERSEDED: 0,
+        UNAFFECTED: 0,
+    }
+
+
+def test_request_after_move_started_schedules_new_move():
+    coalescer = Coalescer(FakeRedis(), window=0.5)
+    doc_id = uuid.uuid4()
+
+    assert coalescer.claim(doc_id) is True
+    coalescer.start(doc_id)
+
+    assert coalescer.claim(doc_id) is True
+
+
+def test_zero_window_disables_coalescing():
+    assert Coalescer(FakeRedis(), window=0).enabled is False
+    assert Coalescer(FakeRedis(), window=0.5).enabled is True
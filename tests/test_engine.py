@@ -0,0 +1,35 @@
+from sqlalchemy.pool import NullPool, QueuePool
+
+from path_tmpl_worker.config import Settings
+from path_tmpl_worker.db.engine import pool_options
+
+PG_URL = "postgresql+psycopg://papermerge:pwd@db/papermerge"
+
+
+def test_pool_options_for_postgresql():
+    settings = Settings(
+        papermerge__database__pool_size=3,
+        papermerge__database__max_overflow=2,
+        papermerge__database__pool_pre_ping=False,
+        papermerge__database__pool_recycle=60,
+    )
+
+    assert pool_options(PG_URL, settings) == {
+        "poolclass": QueuePool,
+        "pool_size": 3,
+        "max_overflow": 2,
+        "pool_pre_ping": False,
+        "pool_recycle": 60,
+    }
+
+
+def test_pool_size_zero_disables_pooling():
+    settings = Settings(papermerge__database__pool_size=0)
+
+    assert pool_options(PG_URL, settings) == {"poolclass": NullPool}
+
+
+def test_sqlite_is_not_pooled():
+    settings = Settings(papermerge__database__pool_size=3)
+
+    assert pool_options("sqlite:///db.sqlite3", settings) == {"poolclass": NullPool}
@@ -0,0 +1,70 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from path_tmpl_worker import api, metrics
+from path_tmpl_worker.metrics import Counter, Histogram, Registry, start_http_server
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(
+        Histogram("stage_seconds", "Stage time", labelname="stage", buckets=(0.1, 1))
+    )
+
+    histogram.observe("commit", 0.05)
+    histogram.observe("commit", 0.5)
+    histogram.observe("commit", 5)
+
+    assert registry.render().splitlines() == [
+        "# HELP stage_seconds Stage time",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="commit",le="0.1"} 1',
+        'stage_seconds_bucket{stage="commit",le="1.0"} 2',
+        'stage_seconds_bucket{stage="commit",le="+Inf"} 3',
+        'stage_seconds_sum{stage="commit"} 5.55',
+        'stage_seconds_count{stage="commit"} 3',
+    ]
+
+
+def test_metrics_endpoint():
+    registry = Registry()
+    registry.register(Counter("moves_total", "Moves")).inc(3)
+    server = start_http_server(0, addr="127.0.0.1", registry=registry)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            body = response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert "moves_total 3.0" in body
+
+
+def test_move_documents_records_stages(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    for i in range(3):
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user)
+    stages = ["fetch_cfv", "evaluate", "mkdir", "update", "commit"]
+    before = {name: metrics.STAGE_SECONDS.count(name) for name in stages}
+    evaluated = metrics.DOCUMENTS_EVALUATED.value
+    created = metrics.FOLDERS_CREATED.value
+    queries = metrics.QUERIES.value
+
+    api.move_documents(db_session, document_type_id=dtype.id)
+
+    for name in stages:
+        assert metrics.STAGE_SECONDS.count(name) == before[name] + 1
+    assert metrics.DOCUMENTS_EVALUATED.value == evaluated + 3
+    # "Receipts" folder
+    assert metrics.FOLDERS_CREATED.value == created + 1
+    assert metrics.QUERIES.value > queries
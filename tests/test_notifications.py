@@ -0,0 +1,96 @@
+import json
+import time
+import uuid
+
+from path_tmpl_worker.constants import (
+    NOTIF_DOCUMENT_MOVED,
+    NOTIF_FOLDER_DOCUMENTS_MOVED,
+)
+from path_tmpl_worker.models import DocumentMovedNotification, Event
+from path_tmpl_worker.notifications import NotificationPublisher, collapse_moves
+from .utils import FakeRedis
+
+
+def make_event(source_folder_id: uuid.UUID, target_folder_id: uuid.UUID):
+    payload = DocumentMovedNotification(
+        document_id=uuid.uuid4(),
+        old_document_title="old.pdf",
+        new_document_title="new.pdf",
+        source_folder_id=source_folder_id,
+        target_folder_id=target_folder_id,
+    )
+    return Event[DocumentMovedNotification](type=NOTIF_DOCUMENT_MOVED, payload=payload)
+
+
+def test_events_are_published_in_batches():
+    client = FakeRedis()
+    publisher = NotificationPublisher(client, "notifications", max_size=3)
+    inbox, home = uuid.uuid4(), uuid.uuid4()
+
+    for _ in range(7):
+        publisher.publish(make_event(inbox, home))
+
+    assert len(client.published) == 6
+    assert client.round_trips == 2
+    assert len(publisher) == 1
+
+    publisher.flush()
+
+    assert len(client.published) == 7
+    assert client.round_trips == 3
+
+
+def test_events_are_published_after_max_delay():
+    client = FakeRedis()
+    publisher = NotificationPublisher(
+        client, "notifications", max_size=100, max_delay=0.05
+    )
+
+    publisher.publish(make_event(uuid.uuid4(), uuid.uuid4()))
+    assert client.published == []
+
+    deadline = time.monotonic() + 5
+    while len(client.published) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert len(client.published) == 1
+
+
+def test_collapse_moves_per_folder_pair():
+    inbox, home, receipts = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    events = [
+        make_event(inbox, receipts),
+        make_event(home, receipts),
+        make_event(inbox, receipts),
+        make_event(inbox, receipts),
+    ]
+
+    collapsed = collapse_moves(events)
+
+    assert [event.type for event in collapsed] == [
+        NOTIF_FOLDER_DOCUMENTS_MOVED,
+        NOTIF_DOCUMENT_MOVED,
+    ]
+    assert collapsed[0].payload.count == 3
+    assert collapsed[0].payload.source_folder_id == inbox
+    assert collapsed[0].payload.target_folder_id == receipts
+    assert collapsed[0].payload.document_ids == [
+        events[i].payload.document_id for i in (0, 2, 3)
+    ]
+    assert collapsed[1] is events[1]
+
+
+def test_publisher_collapses_moves_on_flush():
+    client = FakeRedis()
+    publisher = NotificationPublisher(client, "notifications", collapse=True)
+    inbox, receipts = uuid.uuid4(), uuid.uuid4()
+
+    for _ in range(5):
+        publisher.publish(make_event(inbox, receipts))
+    publisher.flush()
+
+    assert len(client.published) == 1
+    channel, message = client.published[0]
+    assert channel == "notifications"
+    assert json.loads(message)["type"] == NOTIF_FOLDER_DOCUMENTS_MOVED
+    assert json.loads(message)["payload"]["count"] == 5
@@ -1,3 +1,4 @@
+from datetime import date
 from pathlib import PurePath
 
 import jinja2.exceptions
@@ -5,16 +6,28 @@ import pytest
 from pathtmpl import CField
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, event
+from sqlalchemy.exc import NoResultFound
 from path_tmpl_worker.db import get_doc_ctx, update_doc_cfv
 from path_tmpl_worker import constants
 from path_tmpl_worker.db.orm import Folder
+from path_tmpl_worker.db.engine import engine
+from path_tmpl_worker.db.folder_resolver import FolderResolver
 from path_tmpl_worker.db.api import (
     get_home,
     mkdir_node,
     mkdir,
+    mkdir_many,
+    plan_mkdir_many,
+    get_folder_paths,
+    upsert_folder,
+    lookup_path,
     get_path_template,
     mkdir_target,
+    get_docs_by_type,
+    stream_doc_records,
+    get_chunk_bounds,
+    select_cf_by_document_type,
 )
 from .utils import get_ancestors
 
@@ -256,3 +269,318 @@ def test_mkdir_target_invalid_template2(db_session, make_receipt):
 
     with pytest.raises(jinja2.exceptions.TemplateSyntaxError):
         mkdir_target(db_session, document_id=doc.id)
+
+
+def test_get_docs_by_type_resumes_after_last_seen_id(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(5)
+    ]
+
+    pages = [get_docs_by_type(db_session, dtype.id, page_size=2)]
+    while len(pages[-1]) == 2:
+        after_id = pages[-1][-1].id
+        pages.append(
+            get_docs_by_type(db_session, dtype.id, page_size=2, after_id=after_id)
+        )
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    seen_ids = [item.id for page in pages for item in page]
+    assert seen_ids == sorted(doc.id for doc in docs)
+
+
+def test_mkdir_with_shared_resolver(db_session: Session, make_user):
+    user = make_user("john")
+    resolver = FolderResolver()
+
+    first = mkdir(
+        db_session,
+        "/home/My Documents/Invoices/file-01.pdf",
+        user_id=user.id,
+        resolver=resolver,
+    )
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        second = mkdir(
+            db_session,
+            "/home/My Documents/Invoices/file-02.pdf",
+            user_id=user.id,
+            resolver=resolver,
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+
+    assert second.id == first.id
+    # home, "My Documents" and "Invoices" are already resolved
+    assert len(resolver) == 3
+    assert len(statements) == 0
+
+
+def test_mkdir_many(db_session: Session, make_user):
+    user = make_user("john")
+    existing = mkdir(db_session, "/home/Receipts/", user_id=user.id)
+    paths = [
+        "/home/Receipts/2024/rewe.pdf",
+        "/home/Receipts/2024/lidl/",
+        "/home/Receipts/2025/",
+        "/home/bon.pdf",
+    ]
+
+    folder_ids = mkdir_many(db_session, paths, user_id=user.id)
+
+    home = get_home(db_session, user_id=user.id)
+    breadcrumbs = {
+        path: "/" + "/".join(a[1] for a in get_ancestors(db_session, folder_id))
+        for path, folder_id in folder_ids.items()
+    }
+    assert breadcrumbs == {
+        "/home/Receipts/2024/rewe.pdf": "/home/Receipts/2024",
+        "/home/Receipts/2024/lidl/": "/home/Receipts/2024/lidl",
+        "/home/Receipts/2025/": "/home/Receipts/2025",
+        "/home/bon.pdf": "/home",
+    }
+    assert folder_ids["/home/bon.pdf"] == home.id
+    receipts = db_session.execute(
+        select(Folder).where(Folder.title == "Receipts")
+    ).scalars()
+    assert [folder.id for folder in receipts] == [existing.id]
+
+
+def test_plan_mkdir_many_does_not_create_folders(db_session: Session, make_user):
+    user = make_user("john")
+    existing = mkdir(db_session, "/home/Receipts/", user_id=user.id)
+    resolver = FolderResolver()
+    paths = [
+        "/home/Receipts/2024/rewe.pdf",
+        "/home/Receipts/2024/lidl/",
+        "/home/Receipts/bon.pdf",
+    ]
+
+    folder_ids, count = plan_mkdir_many(
+        db_session, paths, user_id=user.id, resolver=resolver
+    )
+    # already planned folders are not counted again
+    _, next_count = plan_mkdir_many(
+        db_session, ["/home/Receipts/2024/"], user_id=user.id, resolver=resolver
+    )
+
+    assert folder_ids == {
+        "/home/Receipts/2024/rewe.pdf": None,
+        "/home/Receipts/2024/lidl/": None,
+        "/home/Receipts/bon.pdf": existing.id,
+    }
+    assert count == 2
+    assert next_count == 0
+    titles = db_session.execute(select(Folder.title)).scalars().all()
+    assert "2024" not in titles
+
+
+def test_get_folder_paths(db_session: Session, make_user):
+    user = make_user("john")
+    receipts = mkdir(db_session, "/home/Receipts/2024/", user_id=user.id)
+    home = get_home(db_session, user_id=user.id)
+
+    paths = get_folder_paths(db_session, [receipts.id, home.id])
+
+    assert paths == {receipts.id: "/home/Receipts/2024/", home.id: "/home/"}
+
+
+def test_upsert_folder_returns_existing_folder(db_session: Session, make_user):
+    user = make_user("john")
+    home_id = user.home_folder_id
+
+    first_id = upsert_folder(db_session, "Receipts", parent_id=home_id, user_id=user.id)
+    second_id = upsert_folder(
+        db_session, "Receipts", parent_id=home_id, user_id=user.id
+    )
+
+    assert first_id == second_id
+    folders = db_session.execute(
+        select(Folder).where(Folder.parent_id == home_id, Folder.title == "Receipts")
+    ).scalars()
+    assert [folder.id for folder in folders] == [first_id]
+
+
+def test_upsert_folder_returns_existing_group_folder(db_session: Session, make_group):
+    group = make_group("family")
+    home_id = group.home_folder_id
+
+    first_id = upsert_folder(
+        db_session, "Receipts", parent_id=home_id, group_id=group.id
+    )
+    second_id = upsert_folder(
+        db_session, "Receipts", parent_id=home_id, group_id=group.id
+    )
+
+    assert first_id == second_id
+
+
+def test_mkdir_group_folder_twice(db_session: Session, make_group):
+    group = make_group("family")
+
+    first = mkdir(db_session, "/home/Receipts/2024/", group_id=group.id)
+    db_session.commit()
+    second = mkdir(db_session, "/home/Receipts/2024/", group_id=group.id)
+    db_session.commit()
+
+    assert first.id == second.id
+    folders = db_session.execute(
+        select(Folder).where(Folder.title.in_(["Receipts", "2024"]))
+    ).scalars()
+    assert len(list(folders)) == 2
+
+
+def test_lookup_path(db_session: Session, make_user):
+    user = make_user("john")
+    invoices = mkdir(db_session, "/home/My Documents/Invoices/", user_id=user.id)
+
+    folder_ids, missing = lookup_path(
+        db_session, ["My Documents", "Invoices", "2024", "12"], user_id=user.id
+    )
+
+    assert folder_ids[0] == user.home_folder_id
+    assert folder_ids[-1] == invoices.id
+    assert len(folder_ids) == 3
+    assert missing == ["2024", "12"]
+
+
+def test_lookup_path_from_parent_folder(db_session: Session, make_user):
+    user = make_user("john")
+    invoices = mkdir(db_session, "/home/My Documents/Invoices/", user_id=user.id)
+
+    folder_ids, missing = lookup_path(
+        db_session, ["Invoices"], parent_id=invoices.parent_id
+    )
+
+    assert folder_ids == [invoices.parent_id, invoices.id]
+    assert missing == []
+
+
+def test_lookup_path_of_user_without_home_folder(db_session: Session, make_user):
+    user = make_user("john")
+    user.home_folder_id = None
+    db_session.commit()
+
+    with pytest.raises(NoResultFound):
+        lookup_path(db_session, ["Receipts"], user_id=user.id)
+
+
+def test_get_docs_by_type_groups_custom_fields_by_document(
+    db_session, make_receipt, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    doc1 = make_receipt(title="bon1.pdf", dtype=dtype, user=user)
+    update_doc_cfv(
+        db_session,
+        document_id=doc1.id,
+        custom_fields={"Total": 10.99, "Shop": "rewe", "EffectiveDate": "2024-11-18"},
+    )
+    make_receipt(title="bon2.pdf", dtype=dtype, user=user)
+
+    docs = get_docs_by_type(db_session, dtype.id)
+
+    assert len(docs) == 2
+    first = next(item for item in docs if item.id == doc1.id)
+    assert first.custom_fields == [
+        ("EffectiveDate", date(2024, 11, 18), "date"),
+        ("Shop", "rewe", "text"),
+        ("Total", 10.99, "monetary"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "cf_names, expected",
+    [
+        (["Shop"], [("Shop", "rewe", "text")]),
+        ([], []),
+        (
+            None,
+            [
+                ("EffectiveDate", date(2024, 11, 18), "date"),
+                ("Shop", "rewe", "text"),
+                ("Total", 10.99, "monetary"),
+            ],
+        ),
+    ],
+)
+def test_stream_doc_records_fetches_only_given_custom_fields(
+    db_session, make_receipt, make_document_type_groceries, user, cf_names, expected
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    doc = make_receipt(title="bon.pdf", dtype=dtype, user=user)
+    update_doc_cfv(
+        db_session,
+        document_id=doc.id,
+        custom_fields={"Total": 10.99, "Shop": "rewe", "EffectiveDate": "2024-11-18"},
+    )
+
+    (record,) = stream_doc_records(db_session, dtype.id, cf_names=cf_names)
+
+    assert record.id == doc.id
+    assert record.custom_fields == expected
+
+
+def test_select_cf_by_document_type_does_not_read_documents(
+    db_session, make_document_type_groceries, user
+):
+    dtype = make_document_type_groceries(title="Groceries", user_id=user.id)
+
+    stmt = select_cf_by_document_type(dtype.id, cf_names={"Shop", "Total"})
+    names = {row.name for row in db_session.execute(stmt)}
+
+    assert names == {"Shop", "Total"}
+    assert "documents" not in str(stmt)
+
+
+def test_get_doc_ctx_fetches_only_given_custom_fields(
+    db_session: Session, make_receipt
+):
+    receipt = make_receipt(title="invoice.pdf", path_template="/home/Receipts/")
+
+    doc = get_doc_ctx(db_session, document_id=receipt.id, cf_names={"Shop"})
+
+    assert set(doc.custom_fields) == {CField(name="Shop", value=None)}
+
+
+@pytest.mark.parametrize("doc_count", [1, 6, 7])
+def test_get_chunk_bounds_covers_all_documents(
+    db_session, make_receipt, make_document_type_groceries, user, doc_count
+):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    doc_ids = sorted(
+        make_receipt(title=f"bon{i}.pdf", dtype=dtype, user=user).id
+        for i in range(doc_count)
+    )
+
+    bounds = get_chunk_bounds(db_session, dtype.id, chunk_size=3)
+
+    assert len(bounds) == (doc_count + 2) // 3
+    assert bounds[0][0] is None
+    assert bounds[-1][1] is None
+    chunks = [
+        [
+            record.id
+            for record in stream_doc_records(
+                db_session, dtype.id, after_id=after_id, until_id=until_id
+            )
+        ]
+        for after_id, until_id in bounds
+    ]
+    assert [len(chunk) for chunk in chunks[:-1]] == [3] * (len(bounds) - 1)
+    assert [doc_id for chunk in chunks for doc_id in chunk] == doc_ids
@@ -0,0 +1,66 @@
+import uuid
+from datetime import date, timedelta
+
+from path_tmpl_worker import api
+from path_tmpl_worker.api import evaluate_documents
+from path_tmpl_worker.parallel import ParallelEvaluator
+from path_tmpl_worker.records import DocumentRecord
+from path_tmpl_worker.template_cache import get_compiled_template
+
+TEMPLATE = """
+{% if document.cf['EffectiveDate'] %}
+    /home/Receipts/{{ document.cf['Shop'] }}/{{ document.cf['EffectiveDate'] }}-{{ document.id }}.pdf
+{% else %}
+    /home/Receipts/{{ document.title }}
+{% endif %}
+"""
+
+
+def make_records(count: int) -> list[DocumentRecord]:
+    records = []
+    for i in range(count):
+        effective_date = date(2024, 1, 1) + timedelta(days=i) if i % 3 else None
+        records.append(
+            DocumentRecord(
+                id=uuid.uuid4(),
+                title=f"receipt-{i}.pdf",
+                parent_id=uuid.uuid4(),
+                document_type_id=None,
+                custom_fields=[
+                    ("EffectiveDate", effective_date, "date"),
+                    ("Shop", ["rewe", "lidl", "aldi"][i % 3], "text"),
+                ],
+            )
+        )
+
+    return records
+
+
+def test_parallel_evaluation_matches_serial_evaluation():
+    records = make_records(101)
+
+    serial = list(evaluate_documents(records, get_compiled_template(TEMPLATE)))
+    with ParallelEvaluator(TEMPLATE, workers=2, batch_size=7) as evaluator:
+        parallel = list(evaluator.evaluate(records))
+
+    assert [(r.id, path) for r, path in parallel] == [
+        (r.id, path) for r, path in serial
+    ]
+
+
+def test_parallel_evaluation_without_documents():
+    with ParallelEvaluator(TEMPLATE, workers=2, batch_size=7) as evaluator:
+        assert list(evaluator.evaluate([])) == []
+
+
+def test_evaluator_falls_back_to_serial_in_daemonic_process(monkeypatch):
+    # e.g. Celery prefork pool processes cannot start a process pool
+    monkeypatch.setattr(api, "can_start_pool", lambda: False)
+    monkeypatch.setattr(api, "ParallelEvaluator", None)
+    records = make_records(11)
+
+    with api.evaluator(TEMPLATE, eval_workers=2) as evaluate:
+        actual = list(evaluate(records))
+
+    serial = list(evaluate_documents(records, get_compiled_template(TEMPLATE)))
+    assert [(r.id, path) for r, path in actual] == [(r.id, path) for r, path in serial]
@@ -0,0 +1,47 @@
+import threading
+
+from sqlalchemy import text
+
+from path_tmpl_worker.db.engine import engine
+from path_tmpl_worker.db.query_recorder import fingerprint, record_queries
+
+
+def test_fingerprint_collapses_values():
+    one = fingerprint("SELECT * FROM nodes WHERE id IN (?)  AND title = 'a'")
+    many = fingerprint(
+        "SELECT * FROM nodes\n WHERE id IN (?, ?, ?) AND title = 'it''s'"
+    )
+
+    assert one == many == "SELECT * FROM nodes WHERE id IN (...) AND title = ?"
+
+
+def test_fingerprint_collapses_multirow_values():
+    one = fingerprint("INSERT INTO nodes (id, title) VALUES (%(id)s, %(title)s)")
+    many = fingerprint("INSERT INTO nodes (id, title) VALUES ($1, $2), ($3, $4)")
+
+    assert one == many == "INSERT INTO nodes (id, title) VALUES (...)"
+
+
+def test_record_queries_groups_by_fingerprint():
+    with record_queries(engine) as recorder:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+            conn.execute(text("SELECT 'x'"))
+
+    assert recorder.count == 3
+    assert recorder.statements["SELECT ?"].count == 3
+    assert recorder.seconds >= 0
+
+
+def test_record_queries_ignores_other_threads():
+    def run():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    with record_queries(engine) as recorder:
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    assert recorder.count == 0
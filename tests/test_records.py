@@ -0,0 +1,60 @@
+import uuid
+from datetime import date
+
+import pytest
+from pathtmpl import DocumentContext, CField, get_evaluated_path
+
+from path_tmpl_worker.records import DocumentRecord, TemplateContext
+from path_tmpl_worker.template_cache import TemplateCache, evaluate
+
+TEMPLATES = [
+    "/home/Receipts/{{ document.id }}.pdf",
+    "/home/{{ document.title }}",
+    """
+    {% if document.has_all_cf %}
+        /home/Receipts/{{ document.cf['Shop'] }}-{{ document.cf['EffectiveDate'] }}.pdf
+    {% else %}
+        /home/Receipts/Incomplete/
+    {% endif %}
+    """,
+    "/home/{{ document.cf['Missing'] }}/{{ document.cf['Total'] }}/",
+    "/home/{% for cf in document.custom_fields %}{{ cf.name }}-{{ cf.value }}/{% endfor %}",
+]
+
+
+@pytest.mark.parametrize("template", TEMPLATES)
+@pytest.mark.parametrize(
+    "custom_fields",
+    [
+        [],
+        [
+            ("EffectiveDate", date(2024, 11, 18), "date"),
+            ("Shop", "rewe", "text"),
+            ("Total", 10.99, "monetary"),
+        ],
+        [
+            ("EffectiveDate", None, "date"),
+            ("Shop", "lidl", "text"),
+            ("Total", 5.25, "monetary"),
+        ],
+    ],
+)
+def test_template_context_evaluates_as_document_context(template, custom_fields):
+    record = DocumentRecord(
+        id=uuid.uuid4(),
+        title="bon.pdf",
+        parent_id=uuid.uuid4(),
+        document_type_id=uuid.uuid4(),
+        custom_fields=custom_fields,
+    )
+    ctx = DocumentContext(
+        id=record.id,
+        title=record.title,
+        custom_fields=[CField(name=cf[0], value=cf[1]) for cf in custom_fields],
+    )
+
+    actual = evaluate(
+        TemplateCache().get(template), TemplateContext.from_record(record)
+    )
+
+    assert actual == get_evaluated_path(ctx, template)
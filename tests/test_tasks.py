@@ -0,0 +1,188 @@
+import json
+import uuid
+
+import pytest
+
+from path_tmpl_worker import api, tasks
+from path_tmpl_worker.bulk_registry import BulkMoveRegistry
+from path_tmpl_worker.checkpoint import RedisCheckpointStore
+from path_tmpl_worker.coalesce import COUNTERS_KEY, UNAFFECTED, Coalescer
+from path_tmpl_worker.models import MoveCheckpoint
+from path_tmpl_worker.notifications import NotificationPublisher
+from path_tmpl_worker.template_cache import fingerprint
+from .utils import FakeRedis, get_ancestors
+
+
+@pytest.fixture
+def client(monkeypatch) -> FakeRedis:
+    """Replaces Redis backed objects of `tasks` with ones using `FakeRedis`"""
+    client = FakeRedis()
+    monkeypatch.setattr(tasks, "redis_instance", client)
+    monkeypatch.setattr(tasks, "checkpoints", RedisCheckpointStore(client))
+    monkeypatch.setattr(tasks, "coalescer", Coalescer(client, window=0))
+    monkeypatch.setattr(
+        tasks, "notifier", NotificationPublisher(client, tasks.CHANNEL, max_size=1)
+    )
+    monkeypatch.setattr(tasks, "bulk_moves", BulkMoveRegistry(client))
+    monkeypatch.setattr(tasks.settings, "papermerge__path_tmpl__chunk_size", 0)
+
+    return client
+
+
+def run_move_documents(document_type_id: uuid.UUID, task_id: str, redelivered=False):
+    task = tasks.move_documents
+    task.push_request(id=task_id, delivery_info={"redelivered": redelivered})
+    try:
+        task.run(str(document_type_id))
+    finally:
+        task.pop_request()
+
+
+@pytest.fixture
+def receipts(make_receipt, make_document_type_groceries, user):
+    dtype = make_document_type_groceries(
+        title="Groceries", user_id=user.id, path_template="/home/Receipts/"
+    )
+    docs = [
+        make_receipt(title=f"receipt-{i}.pdf", dtype=dtype, user=user) for i in range(3)
+    ]
+
+    return dtype, docs
+
+
+def stale_checkpoint(run_id: str, docs) -> MoveCheckpoint:
+    return MoveCheckpoint(
+        run_id=run_id,
+        template_fingerprint=fingerprint("/home/Receipts/"),
+        last_document_id=max(doc.id for doc in docs),
+        count=len(docs),
+    )
+
+
+def parent_title(db_session, doc) -> str:
+    db_session.expire_all()
+    return get_ancestors(db_session, doc.id, include_self=False)[-1][1]
+
+
+def test_move_documents_task_ignores_checkpoint_on_fresh_run(
+    client, receipts, db_session
+):
+    dtype, docs = receipts
+    # same task ID, but not redelivered: checkpoint is a leftover
+    tasks.checkpoints.save(dtype.id, stale_checkpoint("task-1", docs))
+
+    run_move_documents(dtype.id, "task-1")
+
+    assert tasks.checkpoints.get(dtype.id) is None
+    [(_, message)] = client.published
+    assert json.loads(message)["payload"]["count"] == 3
+    assert {parent_title(db_session, doc) for doc in docs} == {"Receipts"}
+
+
+def test_move_documents_task_resumes_when_redelivered(client, receipts, db_session):
+    dtype, docs = receipts
+    tasks.checkpoints.save(dtype.id, stale_checkpoint("task-1", docs))
+
+    run_move_documents(dtype.id, "task-1", redelivered=True)
+
+    assert tasks.checkpoints.get(dtype.id) is None
+    [(_, message)] = client.published
+    # according to checkpoint, all documents were moved before worker died
+    assert json.loads(message)["payload"]["count"] == 3
+    assert {parent_title(db_session, doc) for doc in docs} == {"home"}
+
+
+def test_move_documents_task_clears_checkpoint_on_failure(
+    client, receipts, monkeypatch
+):
+    dtype, docs = receipts
+
+    def fail(*args, checkpoints, **kwargs):
+        checkpoints.save(dtype.id, stale_checkpoint("task-1", docs[:1]))
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(api, "move_documents", fail)
+
+    with pytest.raises(RuntimeError):
+        run_move_documents(dtype.id, "task-1")
+
+    assert tasks.checkpoints.get(dtype.id) is None
+
+
+def test_move_document_task_without_coalescing_skips_coalescer(
+    client, make_receipt, monkeypatch, db_session
+):
+    doc = make_receipt(title="bon.pdf", path_template="/home/Receipts/")
+    commands = []
+
+    def record(name):
+        command = getattr(client, name)
+
+        def _record(*args, **kwargs):
+            commands.append(name)
+            return command(*args, **kwargs)
+
+        return _record
+
+    for name in ("get", "set", "delete", "hincrby", "hgetall", "pipeline"):
+        monkeypatch.setattr(client, name, record(name))
+
+    tasks.move_document(str(doc.id))
+
+    assert parent_title(db_session, doc) == "Receipts"
+    # bulk move lookup and notification; nothing for coalescing
+    assert commands == ["hgetall", "pipeline"]
+    assert client.data.get(COUNTERS_KEY) is None
+
+
+def test_failed_chunk_does_not_prevent_bulk_move_notification(
+    client, receipts, monkeypatch
+):
+    dtype, docs = receipts
+    first, *rest = sorted(doc.id for doc in docs)
+    bounds = [(None, first), (first, None)]
+    tasks.bulk_moves.start(dtype.id, bounds)
+    move_documents = api.move_documents
+
+    def fail_first_chunk(*args, after_id, **kwargs):
+        if after_id is None:
+            raise RuntimeError("database went away")
+        return move_documents(*args, after_id=after_id, **kwargs)
+
+    monkeypatch.setattr(api, "move_documents", fail_first_chunk)
+
+    results = [
+        tasks.move_documents_chunk(
+            str(dtype.id),
+            str(after_id) if after_id else None,
+            str(until_id) if until_id else None,
+        )
+        for after_id, until_id in bounds
+    ]
+    tasks.move_documents_done(results)
+
+    assert results[0] is None
+    # failed chunk is unregistered too
+    assert tasks.bulk_moves.pending_since(dtype.id) is None
+    [(_, message)] = client.published
+    assert json.loads(message)["payload"]["count"] == len(rest)
+
+
+@pytest.mark.parametrize(
+    "changed_fields, title_changed, moved",
+    [(["Total"], False, False), (["Total"], True, False), (["Shop"], False, True)],
+)
+def test_move_document_task_with_changed_fields(
+    client, make_receipt, db_session, changed_fields, title_changed, moved
+):
+    doc = make_receipt(
+        title="bon.pdf", path_template="/home/Receipts/{{ document.cf['Shop'] }}/"
+    )
+
+    tasks.move_document(
+        str(doc.id), changed_fields=changed_fields, title_changed=title_changed
+    )
+
+    assert (parent_title(db_session, doc) != "home") is moved
+    assert len(client.published) == int(moved)
+    assert tasks.coalescer.counters()[UNAFFECTED] == int(not moved)
@@ -0,0 +1,82 @@
+import uuid
+from datetime import date
+
+import pytest
+from jinja2.exceptions import SecurityError
+from pathtmpl import DocumentContext, CField, get_evaluated_path
+
+from path_tmpl_worker.template_cache import TemplateCache, evaluate
+
+
+TEMPLATE = """
+{% if document.cf['Shop'] %}
+    /home/Receipts/{{ document.cf['Shop'] }}-{{ document.id }}.pdf
+{% else %}
+    /home/Receipts/{{ document.id }}.pdf
+{% endif %}
+"""
+
+
+def test_template_is_compiled_once():
+    cache = TemplateCache()
+
+    first = cache.get(TEMPLATE)
+    second = cache.get(TEMPLATE)
+
+    assert first is second
+    info = cache.info()
+    assert info.hits == 1
+    assert info.misses == 1
+    assert info.currsize == 1
+
+
+def test_least_recently_used_template_is_evicted():
+    cache = TemplateCache(maxsize=2)
+
+    cache.get("/home/A/")
+    cache.get("/home/B/")
+    cache.get("/home/A/")
+    cache.get("/home/C/")  # evicts "/home/B/"
+    cache.get("/home/B/")
+
+    info = cache.info()
+    assert info.currsize == 2
+    assert info.misses == 4
+    assert info.hits == 1
+
+
+def test_evaluate_matches_get_evaluated_path():
+    cache = TemplateCache()
+    ctx = DocumentContext(
+        id=uuid.uuid4(),
+        title="bon.pdf",
+        custom_fields=[CField(name="Shop", value="lidl")],
+    )
+
+    actual = evaluate(cache.get(TEMPLATE), ctx)
+
+    assert actual == get_evaluated_path(ctx, TEMPLATE)
+
+
+def test_evaluate_supports_datefmt_filter():
+    template = "/home/Receipts/{{ document.cf['Date'] | datefmt('%Y/%m') }}/"
+    ctx = DocumentContext(
+        id=uuid.uuid4(),
+        title="bon.pdf",
+        custom_fields=[CField(name="Date", value=date(2024, 11, 18))],
+    )
+
+    actual = evaluate(TemplateCache().get(template), ctx)
+
+    assert actual == get_evaluated_path(ctx, template)
+    assert actual == "/home/Receipts/2024/11/"
+
+
+def test_evaluate_blocks_unsafe_attributes():
+    template = "/home/{{ document.__class__.__mro__ }}/"
+    ctx = DocumentContext(id=uuid.uuid4(), title="bon.pdf")
+
+    with pytest.raises(SecurityError):
+        get_evaluated_path(ctx, template)
+    with pytest.raises(SecurityError):
+        evaluate(TemplateCache().get(template), ctx)
@@ -0,0 +1,37 @@
+import pytest
+
+from path_tmpl_worker.template_cache import TemplateCache, env
+from path_tmpl_worker.template_deps import ALL, TemplateDeps, analyze
+
+
+@pytest.mark.parametrize(
+    "template, expected",
+    [
+        ("/home/Receipts/", TemplateDeps(frozenset(), title=False, id=False)),
+        (
+            "/home/{{ document.cf['Shop'] }}/{{ document.id }}.pdf",
+            TemplateDeps(frozenset({"Shop"}), title=False, id=True),
+        ),
+        (
+            """
+            {% set day = document.cf['EffectiveDate'] | string %}
+            /home/{{ document.cf.Shop }}/{{ day[:4] }}/{{ document.title }}
+            """,
+            TemplateDeps(frozenset({"Shop", "EffectiveDate"}), title=True, id=False),
+        ),
+        # cannot be followed statically
+        ("{% if document.has_all_cf %}/home/A/{% endif %}", ALL),
+        ("{% set name = 'Shop' %}/home/{{ document.cf[name] }}/", ALL),
+        ("/home/{{ document.cf.get('Shop') }}/", ALL),
+        ("{% set doc = document %}/home/{{ doc.id }}/", ALL),
+        ("{% for document in items %}{{ document }}{% endfor %}", ALL),
+    ],
+)
+def test_analyze(template, expected):
+    assert analyze(env.parse(template)) == expected
+
+
+def test_compiled_template_has_deps():
+    compiled = TemplateCache().get("/home/{{ document.cf['Shop'] }}/")
+
+    assert compiled.deps.cf_names == {"Shop"}
@@ -63,3 +63,88 @@ def get_ancestors(
     items = list([(id, title) for id, title in result])
 
     return items
+
+
+class FakeRedis:
+    """In memory stand-in for the few Redis commands used by the worker
+
+    Expiration of keys is not simulated.
+    """
+
+    def __init__(self):
+        self.data = {}
+        # (channel, message) of published messages
+        self.published = []
+        # number of executed pipelines
+        self.round_trips = 0
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def hincrby(self, key, field, amount=1):
+        items = self.data.setdefault(key, {})
+        items[field] = items.get(field, 0) + amount
+        return items[field]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        items = self.data.setdefault(key, {})
+        if field is not None:
+            items[field] = value
+        items.update(mapping or {})
+
+    def hsetnx(self, key, field, value):
+        items = self.data.setdefault(key, {})
+        if field in items:
+            return False
+        items[field] = value
+        return True
+
+    def hdel(self, key, *fields):
+        items = self.data.get(key, {})
+        return sum(1 for field in fields if items.pop(field, None) is not None)
+
+    def hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        return 1
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Executes queued commands of `FakeRedis` one after another"""
+
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.client, name), args, kwargs))
+
+        return queue
+
+    def execute(self):
+        self.client.round_trips += 1
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]